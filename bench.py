@@ -0,0 +1,193 @@
+""" Micro-benchmarks for the hot Maze operations
+
+Usage: python bench.py [grid] [visibility] [pellets] [regions] [--width 35] [--height 17] [--pacs 5] [--repeat 2000]
+"""
+import argparse
+import random
+import timeit
+from types import SimpleNamespace
+
+from mapgen import generate_map
+import player
+
+
+def load_maze(rows, pellet_map=player.PelletMap):
+    maze = player.Maze(len(rows[0]), len(rows), rows, pellet_map)
+    maze.construct_nodes()
+    maze.construct_edges()
+    maze.construct_visibility()
+    return maze
+
+
+class DictMaze:
+    """ Reference copy of the original (x, y) dict backed floor plan and pellet map """
+
+    def __init__(self, rows):
+        self.w, self.h = len(rows[0]), len(rows)
+        self.floor_plan = {(x, y): rows[y][x] for y in range(self.h) for x in range(self.w)}
+        self.dirs = ['l', 'd', 'r', 'u']
+        self.pellet_dict = {cell: 1 for cell, value in self.floor_plan.items() if value == ' '}
+
+    def is_floor(self, x, y):
+        return self.floor_plan[(x, y)] == ' '
+
+    def get_coord(self, x, y, dir):
+        if dir == 'l':
+            return (x + self.w - 1, y) if x == 0 else (x - 1, y)
+        elif dir == 'r':
+            return (0, y) if x == self.w - 1 else (x + 1, y)
+        elif dir == 'u':
+            return (x, y) if y == 0 else (x, y - 1)
+        elif dir == 'd':
+            return (x, y) if y == self.h - 1 else (x, y + 1)
+
+    def check_way(self, x, y, dir):
+        return self.is_floor(*self.get_coord(x, y, dir))
+
+    def get_available_dirs(self, x, y):
+        return [dir for dir in self.dirs if self.check_way(x, y, dir)]
+
+    def get_visible_cells(self, x, y):
+        visible_cells = [(x, y)]
+        for dir in self.get_available_dirs(x, y):
+            x0, y0 = x, y
+            while self.check_way(x0, y0, dir):
+                x0, y0 = self.get_coord(x0, y0, dir)
+                visible_cells.append((x0, y0))
+        return visible_cells
+
+    def update_pellet_map(self, turn_id, visible_pellets, my_pacs):
+        all_visible_cells = set()
+        for _, pac in my_pacs.items():
+            all_visible_cells = all_visible_cells.union(set(self.get_visible_cells(pac.x, pac.y)))
+        visible_pellet_cells = set([(x, y) for x, y, value in visible_pellets])
+        no_pellet_cells = all_visible_cells - visible_pellet_cells
+        self.pellet_dict.update({cell: 0 for cell in no_pellet_cells})
+
+
+def random_turn(rows, pac_count, seed):
+    # Random pac positions and the pellets they would see on a fresh map
+    rnd = random.Random(seed)
+    floor = [(x, y) for y, row in enumerate(rows) for x, c in enumerate(row) if c == ' ']
+    my_pacs = {i: SimpleNamespace(x=x, y=y) for i, (x, y) in enumerate(rnd.sample(floor, pac_count))}
+    visible_pellets = [(x, y, 1) for x, y in rnd.sample(floor, len(floor) // 10)]
+    return my_pacs, visible_pellets
+
+
+def report(name, reference, candidate, labels=('reference', 'current')):
+    p_ref, p_new = reference * 1e6, candidate * 1e6
+    print(f'{name:<24} {labels[0]} {p_ref:9.2f} us | {labels[1]} {p_new:9.2f} us | '
+          f'speedup {reference / candidate:5.2f}x')
+
+
+def bench_grid(args):
+    """ Per-turn pellet map update: dict backed floor plan vs flat array grid """
+    rows = generate_map(args.width, args.height, args.seed)
+    my_pacs, visible_pellets = random_turn(rows, args.pacs, args.seed)
+
+    reference = DictMaze(rows)
+    maze = load_maze(rows)
+    maze.update_pellet_map(0, {}, my_pacs)
+
+    t_ref = min(timeit.repeat(lambda: reference.update_pellet_map(1, visible_pellets, my_pacs),
+                              number=args.repeat, repeat=5)) / args.repeat
+    t_new = min(timeit.repeat(lambda: maze.update_pellet_map(1, visible_pellets, my_pacs),
+                              number=args.repeat, repeat=5)) / args.repeat
+    report('update_pellet_map', t_ref, t_new)
+
+    cells = [(x, y) for y in range(maze.h) for x in range(maze.w)]
+    t_ref = min(timeit.repeat(lambda: [reference.check_way(x, y, d) for x, y in cells for d in 'ldru'],
+                              number=args.repeat // 20 or 1, repeat=5)) / (args.repeat // 20 or 1)
+    t_new = min(timeit.repeat(lambda: [maze.check_way(x, y, d) for x, y in cells for d in 'ldru'],
+                              number=args.repeat // 20 or 1, repeat=5)) / (args.repeat // 20 or 1)
+    report('check_way (all cells)', t_ref, t_new)
+
+
+def bench_visibility(args):
+    """ Visible region of all pacs: the original dict backed walk unioning sets vs OR of cached bitsets """
+    rows = generate_map(args.width, args.height, args.seed)
+    reference = DictMaze(rows)
+    maze = load_maze(rows)
+
+    for pac_count in range(1, args.pacs + 1):
+        my_pacs, _ = random_turn(rows, pac_count, args.seed)
+        cells = [(pac.x, pac.y) for _, pac in my_pacs.items()]
+
+        def walk():
+            all_visible_cells = set()
+            for x, y in cells:
+                all_visible_cells = all_visible_cells.union(set(reference.get_visible_cells(x, y)))
+            return all_visible_cells
+
+        t_ref = min(timeit.repeat(walk, number=args.repeat, repeat=5)) / args.repeat
+        t_new = min(timeit.repeat(lambda: maze.get_visible_mask(cells), number=args.repeat, repeat=5)) / args.repeat
+        report(f'visible region {pac_count} pacs', t_ref, t_new)
+
+
+def bench_pellets(args):
+    """ Per-turn pellet map update: bytearray PelletMap vs BitsetPelletMap """
+    rows = generate_map(args.width, args.height, args.seed)
+    turns = [random_turn(rows, args.pacs, seed) for seed in range(args.seed, args.seed + 50)]
+
+    def replay(pellet_map):
+        maze = load_maze(rows, pellet_map)
+
+        def run():
+            maze.update_pellet_map(0, {}, turns[0][0])
+            for turn_id, (my_pacs, visible_pellets) in enumerate(turns[1:], 1):
+                maze.update_pellet_map(turn_id, visible_pellets, my_pacs)
+        return min(timeit.repeat(run, number=args.repeat // 50 or 1, repeat=5)) / (args.repeat // 50 or 1) / len(turns)
+
+    report('update_pellet_map', replay(player.PelletMap), replay(player.BitsetPelletMap), ('array', 'bitset'))
+
+
+def bench_regions(args):
+    """ Per-turn RegionScores refresh and reading every edge's total, region and middle split: lists vs NumPy """
+    rows = generate_map(args.width, args.height, args.seed)
+    maze = load_maze(rows)
+    rnd = random.Random(args.seed)
+    expected = maze.pellet_belief.expected
+    for i in maze.floor_cells:
+        expected[i] = rnd.random() if rnd.random() < 0.7 else 0.0
+    edges = list(maze.edges.values())
+
+    def replay(use_numpy):
+        scores = player.RegionScores(use_numpy)
+        scores.index_edges(maze.edges, maze.w)
+
+        def run():
+            scores.refresh(expected)
+            for e in edges:
+                scores.total(e), scores.region(e), scores.split(e, e.length // 2)
+        return min(timeit.repeat(run, number=args.repeat // 10 or 1, repeat=5)) / (args.repeat // 10 or 1)
+
+    if player.np is None:
+        print(f'{"region scores":<24} python {1e6 * replay(False):9.2f} us | numpy not installed')
+        return
+    report('region scores', replay(False), replay(True), ('python', 'numpy'))
+
+
+BENCHMARKS = {
+    'grid': bench_grid,
+    'visibility': bench_visibility,
+    'pellets': bench_pellets,
+    'regions': bench_regions,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', nargs='*', help=f'any of {", ".join(BENCHMARKS)}, all by default')
+    parser.add_argument('--width', type=int, default=35)
+    parser.add_argument('--height', type=int, default=17)
+    parser.add_argument('--pacs', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmark: {", ".join(sorted(unknown))}')
+
+    print(f'Map {args.width}x{args.height}, {args.pacs} pacs')
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name](args)
@@ -0,0 +1,56 @@
+import random
+
+
+def generate_map(w, h, seed=None):
+    """ Generates a connected, horizontally mirrored Spring Challenge style grid as a list of rows
+
+    ' ' is floor and '#' is wall, top and bottom rows are always wall and one row wraps around
+    """
+    rnd = random.Random(seed)
+    grid = [['#'] * w for _ in range(h)]
+    half = w // 2
+
+    # Carve a spanning maze over odd cells of the left half with a randomised depth first search
+    start = (1, 1)
+    grid[1][1] = ' '
+    stack = [start]
+    seen = {start}
+    while stack:
+        x, y = stack[-1]
+        candidates = [(x + dx, y + dy, dx, dy) for dx, dy in ((2, 0), (-2, 0), (0, 2), (0, -2))
+                      if 1 <= x + dx <= half and 1 <= y + dy < h - 1 and (x + dx, y + dy) not in seen]
+        if not candidates:
+            stack.pop()
+            continue
+        new_x, new_y, dx, dy = rnd.choice(candidates)
+        grid[y + dy // 2][x + dx // 2] = ' '
+        grid[new_y][new_x] = ' '
+        seen.add((new_x, new_y))
+        stack.append((new_x, new_y))
+
+    # Knock down some walls between carved cells to create loops
+    for _ in range(w * h // 12):
+        x, y = rnd.randrange(1, half + 1), rnd.randrange(1, h - 1)
+        if (x + y) % 2 == 1:
+            grid[y][x] = ' '
+
+    # Mirror the left half onto the right half
+    for y in range(h):
+        for x in range(half + 1):
+            grid[y][w - 1 - x] = grid[y][x]
+
+    # Open one row across the horizontal border
+    wrap_y = 1 + 2 * rnd.randrange((h - 1) // 2)
+    grid[wrap_y][0] = ' '
+    grid[wrap_y][w - 1] = ' '
+
+    return [''.join(row) for row in grid]
+
+
+def map_input(rows):
+    """ Referee initialisation lines for a grid """
+    return [f'{len(rows[0])} {len(rows)}'] + list(rows)
+
+
+if __name__ == '__main__':
+    print('\n'.join(generate_map(35, 17)))
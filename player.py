@@ -1,84 +1,923 @@
+import os
 import sys
 import time
-import math
 import random
-import copy
+import heapq
+import itertools
+from array import array
+from bisect import bisect_right
+from collections import deque, namedtuple
+
+
+UNREACHABLE = 0xFFFF  # Distance between cells with no path
+NO_HOP = 0xFF  # Next hop from a cell to itself or to an unreachable cell
+SUPER_PELLET_VALUE = 10
+FIRST_TURN_BUDGET = 1.0  # Seconds to answer the first turn, including the map precomputation
+TURN_BUDGET = 0.05  # Seconds to answer every other turn
+BUDGET_MARGIN = 0.008  # Seconds kept back for publishing and interpreter hiccups
+MAX_TRAVEL_QUEUE = 30  # Longer travel queues are dropped and planned again
+LOOKAHEAD_DEPTH = 6  # Most edges in a lookahead route
+LOOKAHEAD_MAX_MOVES = 24  # Most moves in a lookahead route, keeps it under MAX_TRAVEL_QUEUE when chained
+AUCTION_EPSILON = 0.01  # Smallest price raise in the edge auction, assignments are within pacs * epsilon of optimal
+SPEED_DURATION = 5  # Turns of double moves after SPEED
+ABILITY_COOLDOWN = 10  # Turns before SPEED or SWITCH can be used again
+ENEMY_MEMORY = 8  # Turns an enemy out of sight is tracked before it is forgotten
+ENEMY_THREAT_TURNS = 2  # Turns out of sight an enemy's possible cells still count as a threat
+DANGER_HORIZON = 8  # Turns ahead the danger map looks, cells no threat reaches sooner are safe
+DANGER_EDGE_TURNS = 1  # Edges a threat may reach within this many turns hold no pellets for the planners
+STRONGER_TYPE = {'ROCK': 'PAPER', 'PAPER': 'SCISSORS', 'SCISSORS': 'ROCK'}  # type -> type that eats it
+OPENING_TURNS = 30  # Turns the super pellet opening plan is followed at most
+ROLLOUT_DEPTH = 4  # Turns played out by the encounter evaluator
+ROLLOUTS = 24  # Rollouts per candidate action at most
+MIN_ROLLOUTS = 4  # With time for fewer rollouts per action the encounter decision tree is used instead
+KILL_VALUE = 20.0  # Rollout value of eating an enemy pac
+DEATH_COST = 60.0  # Rollout cost of losing the pac
+DIRS = ('l', 'd', 'r', 'u')  # Direction index -> direction, Node.edges and Edge.dir1 / dir2 hold indices
+
+
+try:
+    popcount = int.bit_count  # Python 3.10+
+except AttributeError:
+    def popcount(x):
+        return bin(x).count('1')
+
+try:
+    import numpy as np  # Optional, RegionScores falls back to plain Python without it
+except ImportError:
+    np = None
 
 
 def p(*args, **kwargs):
     return print(*args, **kwargs, file=sys.stderr)
 
 
+TurnInput = namedtuple('TurnInput', ['my_score', 'opponent_score', 'pacs', 'pellets'])
+# pacs: [(pac_id, mine, x, y, type_id, speed_turns_left, ability_cooldown)], pellets: [(x, y, value)]
+
+
+class InputReader:
+    """ Reads referee input in bulk chunks and decodes whole blocks into compact tuples
+
+    Reads from `sys.stdin` by default, any text stream (file, io.StringIO) can be passed instead
+    """
+
+    def __init__(self, stream=None, chunk_size=1 << 16):
+        self.stream = stream if stream is not None else sys.stdin
+        self.chunk_size = chunk_size
+        self.lines = deque()  # complete lines not consumed yet
+        self.partial = ''  # trailing line fragment of the last chunk
+        try:
+            self.fd = self.stream.fileno()
+        except (AttributeError, OSError, ValueError):
+            self.fd = None  # In-memory buffer
+
+    def _fill(self):
+        # Read whatever is available in one call, the referee writes each block at once
+        if self.fd is not None:
+            chunk = os.read(self.fd, self.chunk_size).decode()
+        else:
+            chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            raise EOFError('Referee input closed')
+
+        lines = (self.partial + chunk).split('\n')
+        self.partial = lines.pop()
+        self.lines.extend(line.rstrip('\r') for line in lines)
+
+    def _line(self):
+        while not self.lines:
+            self._fill()
+        return self.lines.popleft()
+
+    def _block(self, count):
+        while len(self.lines) < count:
+            self._fill()
+        return [self.lines.popleft() for _ in range(count)]
+
+    def read_map(self):
+        """ Returns (width, height, rows) """
+        w, h = [int(i) for i in self._line().split()]
+        return w, h, self._block(h)
+
+    def read_turn(self, turn_id=0, timer=None):
+        """ Returns the TurnInput of the next turn, starting `timer` once its first line is read """
+        my_score, opponent_score = [int(i) for i in self._line().split()]
+        if timer is not None and turn_id > 0:
+            timer.start(turn_id)
+
+        pacs = list()
+        for line in self._block(int(self._line())):
+            pac_id, mine, x, y, type_id, speed_turns_left, ability_cooldown = line.split()
+            pacs.append((int(pac_id), mine != '0', int(x), int(y), type_id, int(speed_turns_left),
+                         int(ability_cooldown)))
+
+        pellets = list()
+        for line in self._block(int(self._line())):
+            x, y, value = line.split()
+            pellets.append((int(x), int(y), int(value)))
+
+        return TurnInput(my_score, opponent_score, pacs, pellets)
+
+
 class Commander:
-    def __init__(self):
+    def __init__(self, sink=print):
         self.command_queue = list()
+        self.sink = sink  # Receives the published command line, stdout by default
 
     def add_command(self, command):
         self.command_queue.append(command)
 
     def publish(self):
         publish_str = ' | '.join([x.strip() for x in self.command_queue])
-        print(publish_str)
+        self.sink(publish_str)
         self.command_queue = list()
 
 
+class TurnTimer:
+    """ Measures the current turn against the referee response deadline and keeps per-turn history """
+
+    def __init__(self, first_turn_budget=FIRST_TURN_BUDGET, turn_budget=TURN_BUDGET, margin=BUDGET_MARGIN):
+        self.first_turn_budget = first_turn_budget
+        self.turn_budget = turn_budget
+        self.margin = margin
+        self.turn_id = None
+        self.budget = first_turn_budget
+        self.start_time = time.perf_counter()
+        self.history = list()  # elapsed seconds of every finished turn
+
+    def start(self, turn_id):
+        self.turn_id = turn_id
+        self.budget = self.first_turn_budget if turn_id == 0 else self.turn_budget
+        self.start_time = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def remaining(self):
+        """ Seconds left before the deadline, less the safety margin """
+        return self.budget - self.margin - self.elapsed()
+
+    def expired(self, reserve=0.0):
+        return self.remaining() <= reserve
+
+    def deepen(self, search, max_depth, reserve=0.0):
+        """ Anytime iterative deepening
+
+        Calls `search(depth)` for increasing depths while the next, deeper iteration is expected to fit in
+        the remaining budget and returns the result of the deepest one that completed (None results are skipped)
+        """
+        best = None
+        for depth in range(1, max_depth + 1):
+            t0 = time.perf_counter()
+            result = search(depth)
+            if result is not None:
+                best = result
+            took = time.perf_counter() - t0
+
+            # Assume the next depth costs at least twice as much as this one
+            if self.remaining() - reserve < 2 * took:
+                break
+        return best
+
+    def stop(self):
+        elapsed = self.elapsed()
+        self.history.append(elapsed)
+        return elapsed
+
+    def percentile(self, q):
+        ordered = sorted(self.history)
+        return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))]
+
+    def log(self):
+        ms = [1000 * x for x in (self.history[-1], self.percentile(50), self.percentile(90),
+                                 self.percentile(99), max(self.history))]
+        p('Turn {} took {:.1f}ms | p50 {:.1f}ms p90 {:.1f}ms p99 {:.1f}ms max {:.1f}ms'.format(self.turn_id, *ms))
+
+
 class Node:
+    __slots__ = ('id', 'x', 'y', 'type', 'edges')
+
     def __init__(self, id, x, y, type):
         self.id = id
         self.x = x
         self.y = y
         self.type = type
-        self.l = None
-        self.r = None
-        self.u = None
-        self.d = None
-
-    def __getitem__(self, item):
-        return self.__dict__[item]
-
-    def __setitem__(self, key, value):
-        self.__dict__[key] = value
+        self.edges = [None] * len(DIRS)  # direction index -> Edge leaving that way
 
     def __eq__(self, other):
         return self.id == other.id
 
 
 class Edge:
+    __slots__ = ('id', 'node1', 'dir1', 'node2', 'dir2', 'path', 'length', 'pellets', 'expected', 'mask')
+
     def __init__(self, id, node, dir):
         self.id = id
         self.node1 = node
-        self.dir1 = dir
+        self.dir1 = dir  # Direction index leaving node1
         self.node2 = None
-        self.dir2 = None
+        self.dir2 = None  # Direction index leaving node2
         self.path = list()
         self.length = 0
         self.pellets = 0
+        self.expected = 0.0  # Pellet value expected to be left, see PelletBelief
+        self.mask = 0  # bitset of the cell indices strictly between its nodes
+
+    def other_node(self, node):
+        return self.node2 if self.node1 == node else self.node1
+
+
+class Route:
+    """ Travel queue of a pac, a sequence of cells with a cursor on the pac's position
+
+    Cells are kept as views (cells, start, count, step) over shared lists, mostly Edge.path, so routes are
+    built, chained and reversed without copying paths. Reversal only flips a flag, indexes are logical.
+    """
+    __slots__ = ('views', 'ends', 'backwards', 'cursor')
+
+    def __init__(self, cells=None):
+        self.views = list()  # (cells, start, count, step) in stored order
+        self.ends = list()  # Cells up to the end of each view in stored order
+        self.backwards = False  # Logical order is the stored order reversed
+        self.cursor = 0  # Logical index of the pac's cell
+        if cells:
+            self.append(cells)
+
+    @classmethod
+    def along(cls, e, node, skip=0):
+        """ Route along edge `e` leaving `node`, without its first `skip` cells """
+        route = cls()
+        route.append_edge(e, node, skip)
+        return route
+
+    def __len__(self):
+        return self.ends[-1] if self.ends else 0
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('route index out of range')
+        if self.backwards:
+            i = n - 1 - i
+        j = bisect_right(self.ends, i)
+        cells, start, count, step = self.views[j]
+        return cells[start + (i - (self.ends[j - 1] if j else 0)) * step]
+
+    def __iter__(self):
+        return self.cells()
+
+    def __contains__(self, cell):
+        return any(c == cell for c in self.cells())
+
+    def __repr__(self):
+        return repr(list(self.cells()))
+
+    def _logical_views(self):
+        if not self.backwards:
+            return iter(self.views)
+        return ((cells, start + (count - 1) * step, count, -step) for cells, start, count, step in reversed(self.views))
+
+    def cells(self, start=0):
+        """ Cells in travel order from logical index `start` """
+        for cells, first, count, step in self._logical_views():
+            if start >= count:
+                start -= count
+                continue
+            for k in range(start, count):
+                yield cells[first + k * step]
+            start = 0
+
+    def ahead(self, steps):
+        """ Up to `steps` cells following the cursor """
+        return [self[i] for i in range(self.cursor + 1, min(self.cursor + 1 + steps, len(self)))]
+
+    def _normalise(self):
+        # Store in logical order again so appending stays at the end of the list
+        if self.backwards:
+            views = list(self._logical_views())
+            self.views, self.ends, self.backwards = list(), list(), False
+            for view in views:
+                self._append_view(*view)
+
+    def _append_view(self, cells, start, count, step):
+        if count > 0:
+            self.views.append((cells, start, count, step))
+            self.ends.append(len(self) + count)
+
+    def append(self, cells, start=0, count=None, step=1):
+        """ Appends `count` cells of the list `cells` from index `start` on, backwards for a step of -1 """
+        self._normalise()
+        self._append_view(cells, start, len(cells) - start if count is None else count, step)
+
+    def append_edge(self, e, node, skip=0):
+        """ Appends the path of edge `e` leaving `node`, without its first `skip` cells """
+        if e.node1 == node:
+            self.append(e.path, skip, e.length - skip, 1)
+        else:
+            self.append(e.path, e.length - 1 - skip, e.length - skip, -1)
+
+    def extend(self, other, skip=0):
+        """ Appends the cells of route `other` without its first `skip` cells """
+        self._normalise()
+        for cells, start, count, step in list(other._logical_views()):
+            if skip >= count:
+                skip -= count
+                continue
+            self._append_view(cells, start + skip * step, count - skip, step)
+            skip = 0
+
+    def reverse(self):
+        self.backwards = not self.backwards
+        self.cursor = max(0, len(self) - 1 - self.cursor)
+
+    def reversed(self):
+        """ Reversed copy sharing the cell lists """
+        route = Route()
+        route.views, route.ends, route.backwards = list(self.views), list(self.ends), not self.backwards
+        route.cursor = max(0, len(self) - 1 - self.cursor)
+        return route
+
+    def truncate(self, n):
+        """ Keeps the first `n` cells """
+        if n >= len(self):
+            return
+        self._normalise()
+        views = self.views
+        self.views, self.ends = list(), list()
+        for cells, start, count, step in views:
+            if n <= 0:
+                break
+            self._append_view(cells, start, min(count, n), step)
+            n -= count
+        self.cursor = min(self.cursor, max(0, len(self) - 1))
+
+    def drop_travelled(self):
+        """ Drops the cells before the cursor """
+        if self.cursor:
+            route = Route()
+            route.extend(self, self.cursor)
+            self.views, self.ends, self.backwards, self.cursor = route.views, route.ends, False, 0
+
+    def find(self, cell, last=False):
+        """ Logical index of the first, or last, visit of `cell`, -1 if the route does not pass it """
+        found = -1
+        for i, c in enumerate(self.cells()):
+            if c == cell:
+                if not last:
+                    return i
+                found = i
+        return found
+
+
+class PelletMap:
+    """ (x, y) -> pellet value view over a flat bytearray indexed by cell
+
+    Keeps `Edge.pellets` and the map total current with delta updates as cells change value
+    """
+
+    def __init__(self, w, h):
+        self.w = w
+        self.values = bytearray(w * h)
+        self.cell_edges = dict()  # cell index -> [Edge] whose path holds the cell
+        self.mask = 0  # bitset of cell indices holding a pellet
+        self.super_mask = 0  # bitset of cell indices holding a super pellet
+        self.total = 0
+
+    def __getitem__(self, cell):
+        return self.values[cell[1] * self.w + cell[0]]
+
+    def __setitem__(self, cell, value):
+        self.set(cell[1] * self.w + cell[0], value)
+
+    def index_edges(self, edges):
+        for _, e in edges.items():
+            for x, y in e.path:
+                self.cell_edges.setdefault(y * self.w + x, list()).append(e)
+
+    def reset(self, values):
+        self.values[:] = values
+        self.recount()
+
+    def recount(self):
+        # Full recount of the map total and every edge total
+        self.total = sum(self.values)
+        self.mask = 0
+        self.super_mask = 0
+        for i, value in enumerate(self.values):
+            if value:
+                self.mask |= 1 << i
+            if value > 1:
+                self.super_mask |= 1 << i
+        edges = {e.id: e for cell_edges in self.cell_edges.values() for e in cell_edges}
+        for _, e in edges.items():
+            e.pellets = 0
+        for i, cell_edges in self.cell_edges.items():
+            for e in cell_edges:
+                e.pellets += self.values[i]
+
+    def set(self, i, value):
+        delta = value - self.values[i]
+        if delta == 0:
+            return
+        self.values[i] = value
+        self.total += delta
+        for e in self.cell_edges.get(i, ()):
+            e.pellets += delta
+        if value > 1:
+            self.super_mask |= 1 << i
+        else:
+            self.super_mask &= ~(1 << i)
+        if value:
+            self.mask |= 1 << i
+        else:
+            self.mask &= ~(1 << i)
+
+    def clear_mask(self, mask):
+        # Empty every cell in the `mask` bitset, only walking the cells that still hold a pellet
+        mask &= self.mask
+        while mask:
+            low = mask & -mask
+            self.set(low.bit_length() - 1, 0)
+            mask ^= low
+
+
+class BitsetPelletMap:
+    """ (x, y) -> pellet value view over two bitsets of cell indices, "possibly pellet" and "super pellet"
+
+    Drop-in for PelletMap. Clearing cells is a single AND-NOT and `Edge.pellets` is a popcount over
+    precomputed edge masks, recomputed only for edges touched by the change. Single cells update the
+    totals with deltas like PelletMap
+    """
+
+    def __init__(self, w, h):
+        self.w = w
+        self.edge_masks = list()  # [(Edge, bitset of cell indices on its path)]
+        self.cell_edges = dict()  # cell index -> [Edge] whose path holds the cell
+        self.mask = 0  # bitset of cell indices possibly holding a pellet
+        self.super_mask = 0  # bitset of cell indices holding a super pellet
+        self.total = 0
+
+    def __getitem__(self, cell):
+        i = cell[1] * self.w + cell[0]
+        if self.super_mask >> i & 1:
+            return SUPER_PELLET_VALUE
+        return self.mask >> i & 1
+
+    def __setitem__(self, cell, value):
+        self.set(cell[1] * self.w + cell[0], value)
+
+    def index_edges(self, edges):
+        for _, e in edges.items():
+            edge_mask = 0
+            for x, y in e.path:
+                edge_mask |= 1 << (y * self.w + x)
+                self.cell_edges.setdefault(y * self.w + x, list()).append(e)
+            self.edge_masks.append((e, edge_mask))
+
+    def _count(self, mask):
+        return popcount(mask & self.mask) + (SUPER_PELLET_VALUE - 1) * popcount(mask & self.super_mask)
+
+    def reset(self, values):
+        self.mask = 0
+        self.super_mask = 0
+        for i, value in enumerate(values):
+            if value:
+                self.mask |= 1 << i
+            if value > 1:
+                self.super_mask |= 1 << i
+        self.recount()
+
+    def recount(self):
+        self.total = self._count(-1)
+        for e, edge_mask in self.edge_masks:
+            e.pellets = self._count(edge_mask)
+
+    def set(self, i, value):
+        bit = 1 << i
+        # The bitsets only tell empty, pellet and super pellet apart
+        delta = (SUPER_PELLET_VALUE if value > 1 else 1 if value else 0) - self._count(bit)
+        if value:
+            self.mask |= bit
+        else:
+            self.mask &= ~bit
+        if value > 1:
+            self.super_mask |= bit
+        else:
+            self.super_mask &= ~bit
+        if delta == 0:
+            return
+        self.total += delta
+        for e in self.cell_edges.get(i, ()):
+            e.pellets += delta
+
+    def clear_mask(self, mask):
+        cleared = mask & self.mask
+        if not cleared:
+            return
+        self.total -= self._count(cleared)
+        self.mask &= ~mask
+        self.super_mask &= ~mask
+        for e, edge_mask in self.edge_masks:
+            if edge_mask & cleared:
+                e.pellets = self._count(edge_mask)
+
+
+class PelletBelief:
+    """ (x, y) -> expected pellet value, the pellet map's value weighted by the odds it was not eaten unseen
+
+    Cells in sight hold their exact value. Out of sight, the opponent's score gain that the enemies in
+    sight do not explain is taken off the cells the hidden enemies may have reached, in proportion to
+    what they hold. Keeps `Edge.expected` current with delta updates like PelletMap does `Edge.pellets`.
+    """
+
+    def __init__(self, w, h):
+        self.w = w
+        self.expected = array('d', [0.0]) * (w * h)
+        self.cell_edges = dict()  # cell index -> [Edge] whose path holds the cell
+        self.mask = 0  # bitset of cell indices with a positive expected value
+        self.opponent_score = 0
+
+    def __getitem__(self, cell):
+        return self.expected[cell[1] * self.w + cell[0]]
+
+    def index_edges(self, edges):
+        for _, e in edges.items():
+            for x, y in e.path:
+                self.cell_edges.setdefault(y * self.w + x, list()).append(e)
+
+    def reset(self, values):
+        self.mask = 0
+        for i, value in enumerate(values):
+            self.expected[i] = value
+            if value:
+                self.mask |= 1 << i
+        edges = {e.id: e for cell_edges in self.cell_edges.values() for e in cell_edges}
+        for _, e in edges.items():
+            e.expected = 0.0
+        for i, cell_edges in self.cell_edges.items():
+            for e in cell_edges:
+                e.expected += self.expected[i]
+
+    def set(self, i, value):
+        delta = value - self.expected[i]
+        if delta == 0:
+            return
+        self.expected[i] = value
+        for e in self.cell_edges.get(i, ()):
+            e.expected += delta
+        if value > 0:
+            self.mask |= 1 << i
+        else:
+            self.mask &= ~(1 << i)
+
+    def total(self, mask):
+        """ Expected value held by the cells of the `mask` bitset """
+        total = 0.0
+        mask &= self.mask
+        while mask:
+            low = mask & -mask
+            total += self.expected[low.bit_length() - 1]
+            mask ^= low
+        return total
+
+    def scale(self, mask, factor):
+        mask &= self.mask
+        while mask:
+            low = mask & -mask
+            i = low.bit_length() - 1
+            self.set(i, self.expected[i] * factor)
+            mask ^= low
+
+    def update(self, opponent_score, pellets, visible_pellets, hidden_mask, enemies):
+        """ Syncs with the pellet map `pellets` and takes the opponent's unexplained score gain off the cells
+        out of sight, `hidden_mask` being the bitset of floor cells our pacs do not see
+        """
+        gained = opponent_score - self.opponent_score
+        self.opponent_score = opponent_score
+
+        # Pellets under the enemies in sight, and super pellets gone out of sight, explain part of the gain
+        for enemy in enemies.enemies.values():
+            if enemy.seen_turn == enemies.turn_id:
+                gained -= self.expected[enemy.y * self.w + enemy.x]
+        gone = self.mask & ~pellets.mask
+        gained -= self.total(gone & hidden_mask)
+
+        self.scale(gone, 0.0)
+        for x, y, value in visible_pellets:
+            self.set(y * self.w + x, value)
+
+        if gained > 0:
+            region = 0
+            for enemy in enemies.enemies.values():
+                if enemy.seen_turn != enemies.turn_id:
+                    region |= enemy.mask
+            region = (region or hidden_mask) & hidden_mask
+            mass = self.total(region)
+            if mass > 0:
+                self.scale(region, max(0.0, 1.0 - gained / mass))
+
+
+class RegionScores:
+    """ Expected pellet value of every edge, of the cells along it and of its region, rebuilt once per turn
+
+    Edge paths are stored CSR style, `indptr[k]:indptr[k + 1]` slices the cell indices of edge row k out
+    of `indices`, and so are the edges sharing a node with each edge. A refresh gathers the expected values
+    along every path into one prefix sum, edge totals and splits along a path are differences of it.
+    With NumPy the refresh is a handful of array calls and the sums stay arrays read in place, without it
+    the same sums are built as plain Python lists.
+    """
+
+    def __init__(self, use_numpy=True):
+        self.numpy = use_numpy and np is not None
+        self.rows = dict()  # Edge id -> row
+        self.indptr = [0]  # row -> offset of the edge path in `indices`
+        self.indices = list()  # Cell indices along every edge path
+        self.adj_indptr = [0]  # row -> offset of the neighbouring edge rows in `adj_indices`
+        self.adj_indices = list()  # Rows of the edges sharing a node with each edge, itself excluded
+        self.prefix = [0.0]  # Sum of the expected values of the first k entries of `indices`
+        self.totals = list()  # row -> expected value along the edge path
+        self.regions = list()  # row -> expected value of the edge and the edges sharing a node with it
+
+    def index_edges(self, edges, w):
+        for _, e in edges.items():
+            self.rows[e.id] = len(self.rows)
+            self.indices.extend(y * w + x for x, y in e.path)
+            self.indptr.append(len(self.indices))
+        for _, e in edges.items():
+            adjacent = {self.rows[other.id] for node in (e.node1, e.node2) if node is not None
+                        for other in node.edges if other is not None and other.id != e.id}
+            self.adj_indices.extend(sorted(adjacent))
+            self.adj_indptr.append(len(self.adj_indices))
+        if self.numpy:
+            self.indptr = np.array(self.indptr, dtype=np.intp)
+            self.indices = np.array(self.indices, dtype=np.intp)
+            self.adj_indptr = np.array(self.adj_indptr, dtype=np.intp)
+            self.adj_indices = np.array(self.adj_indices, dtype=np.intp)
+
+    def refresh(self, expected):
+        """ Rebuilds the sums from `expected`, the array('d') of expected values by cell index """
+        if not self.rows:
+            return
+        if self.numpy:
+            values = np.frombuffer(expected, dtype=np.float64)
+            prefix = np.zeros(len(self.indices) + 1)
+            np.cumsum(values[self.indices], out=prefix[1:])
+            totals = prefix[self.indptr[1:]] - prefix[self.indptr[:-1]]
+            adjacent = np.zeros(len(self.adj_indices) + 1)
+            np.cumsum(totals[self.adj_indices], out=adjacent[1:])
+            self.regions = totals + adjacent[self.adj_indptr[1:]] - adjacent[self.adj_indptr[:-1]]
+            self.prefix, self.totals = prefix, totals
+            return
+
+        self.prefix = list(itertools.accumulate((expected[i] for i in self.indices), initial=0.0))
+        prefix, indptr = self.prefix, self.indptr
+        self.totals = [prefix[indptr[k + 1]] - prefix[indptr[k]] for k in range(len(indptr) - 1)]
+        totals, adj_indptr, adj_indices = self.totals, self.adj_indptr, self.adj_indices
+        self.regions = [totals[k] + sum(totals[j] for j in adj_indices[adj_indptr[k]:adj_indptr[k + 1]])
+                        for k in range(len(totals))]
+
+    def total(self, e):
+        return float(self.totals[self.rows[e.id]])
+
+    def region(self, e):
+        return float(self.regions[self.rows[e.id]])
+
+    def split(self, e, index):
+        """ Expected value of the path cells of `e` before and after path index `index`, both exclusive """
+        start = int(self.indptr[self.rows[e.id]])
+        prefix = self.prefix
+        return (float(prefix[start + index] - prefix[start]),
+                float(prefix[start + e.length] - prefix[start + index + 1]))
+
+
+class Enemy:
+    """ An enemy pac as last seen, with the bitset of cells it may have reached since """
+    __slots__ = ('id', 'x', 'y', 'type_id', 'speed_turns_left', 'ability_cooldown', 'seen_turn', 'mask', 'maze')
+
+    def __init__(self, id, x, y, type_id, speed_turns_left, ability_cooldown, turn_id, maze):
+        self.id = id
+        self.maze = maze
+        self.see(turn_id, x, y, type_id, speed_turns_left, ability_cooldown)
+
+    def see(self, turn_id, x, y, type_id, speed_turns_left, ability_cooldown):
+        self.x = x
+        self.y = y
+        self.type_id = type_id
+        self.speed_turns_left = speed_turns_left
+        self.ability_cooldown = ability_cooldown
+        self.seen_turn = turn_id
+        self.mask = 1 << (y * self.maze.w + x)  # bitset of the cell indices it may be on
+
+    def propagate(self, hidden_mask):
+        """ Moves the enemy out of sight one turn on, it may be on any cell of `hidden_mask` it can reach
+
+        An enemy whose ability is ready is assumed to use SPEED, which covers a move, a SWITCH or a stay.
+        """
+        steps, self.speed_turns_left, self.ability_cooldown = self.next_turn(self.speed_turns_left,
+                                                                             self.ability_cooldown)
+        self.mask = self.maze.expand_mask(self.mask, steps) & hidden_mask
+
+    @staticmethod
+    def next_turn(speed_turns_left, ability_cooldown):
+        # (moves this turn, speed turns left, ability cooldown) of an enemy using SPEED as soon as it can
+        if ability_cooldown == 0:
+            return 1, SPEED_DURATION, ABILITY_COOLDOWN
+        return 2 if speed_turns_left > 0 else 1, max(0, speed_turns_left - 1), ability_cooldown - 1
+
+    def reach(self, turns):
+        """ [bitset of the cells the enemy may be on after t turns for t in 0..`turns`] """
+        speed_turns_left, ability_cooldown = self.speed_turns_left, self.ability_cooldown
+        layers = [self.mask]
+        for _ in range(turns):
+            steps, speed_turns_left, ability_cooldown = self.next_turn(speed_turns_left, ability_cooldown)
+            layers.append(self.maze.expand_mask(layers[-1], steps))
+        return layers
+
+    def distance(self, x, y):
+        return self.maze.distance((self.x, self.y), (x, y))
+
+    def closest_cell(self, cell):
+        """ (distance, (x, y)) of the cell the enemy may be on closest to `cell` """
+        maze = self.maze
+        best = None
+        mask = self.mask
+        while mask:
+            low = mask & -mask
+            candidate = maze.cells[low.bit_length() - 1]
+            dist = maze.distance(cell, candidate)
+            if best is None or dist < best[0]:
+                best = (dist, candidate)
+            mask ^= low
+        return best
+
+    def at(self, cell):
+        """ Copy of the enemy standing on `cell` """
+        enemy = Enemy(self.id, cell[0], cell[1], self.type_id, self.speed_turns_left, self.ability_cooldown,
+                      self.seen_turn, self.maze)
+        enemy.mask = self.mask
+        return enemy
+
+
+class EnemyTracker:
+    """ Enemy pacs remembered through the fog of war
+
+    Every enemy keeps its last sighting and a bitset of the cells it may be on, grown each turn it is out
+    of sight by the moves it could make and cut by what our pacs see. Enemies out of sight for more than
+    ENEMY_MEMORY turns, or that cannot be anywhere we do not see, are forgotten, so the cost per turn stays
+    a few big integer operations per enemy.
+
+    The danger map holds, for each pac type and cell, the earliest turn an enemy eating that type could be
+    there: the bitset layers of the cells each recent enemy may reach turn by turn (`Enemy.reach`) are
+    ORed together per type, and every cell takes the first layer it appears in.
+    """
+
+    def __init__(self, maze):
+        self.maze = maze
+        self.enemies = dict()  # pac_id -> Enemy
+        self.visible = dict()  # pac_id -> Enemy in sight this turn, in input order
+        self.turn_id = 0
+        self.safe = array('B', [DANGER_HORIZON + 1]) * (maze.w * maze.h)
+        self.danger = {type_id: array('B', self.safe) for type_id in STRONGER_TYPE}  # type -> cell index -> turns
+        self.danger_masks = dict()  # type -> [bitset of the cells a threat may reach within t turns]
+
+    def update(self, turn_id, visible_pacs, my_pacs):
+        maze = self.maze
+        self.turn_id = turn_id
+        hidden_mask = ~maze.get_visible_mask([(pac.x, pac.y) for _, pac in my_pacs.items()])
+
+        seen = set()
+        self.visible = dict()
+        for pac_id, mine, x, y, type_id, speed_turns_left, ability_cooldown in visible_pacs:
+            if mine:
+                continue
+            seen.add(pac_id)
+            if pac_id in self.enemies:
+                self.enemies[pac_id].see(turn_id, x, y, type_id, speed_turns_left, ability_cooldown)
+            else:
+                self.enemies[pac_id] = Enemy(pac_id, x, y, type_id, speed_turns_left, ability_cooldown, turn_id,
+                                             maze)
+            self.visible[pac_id] = self.enemies[pac_id]
+
+        if turn_id == 0:
+            # Start positions are mirrored, every enemy starts opposite our pac of the same id and type
+            for pac_id, pac in my_pacs.items():
+                if pac_id not in self.enemies:
+                    self.enemies[pac_id] = Enemy(pac_id, maze.w - 1 - pac.x, pac.y, pac.type_id, 0, 0, turn_id, maze)
+                    seen.add(pac_id)
+
+        for pac_id, enemy in list(self.enemies.items()):
+            if pac_id in seen:
+                continue
+            enemy.propagate(hidden_mask)
+            if not enemy.mask or turn_id - enemy.seen_turn > ENEMY_MEMORY:
+                del self.enemies[pac_id]
+
+        self.construct_danger()
+
+    def construct_danger(self):
+        # Every threat spreads its possible cells one turn at a time, moving two cells a turn under SPEED
+        self.danger_masks = {type_id: [0] * (DANGER_HORIZON + 1) for type_id in STRONGER_TYPE}
+        for enemy in self.recent():
+            layers = enemy.reach(DANGER_HORIZON)
+            for type_id, stronger in STRONGER_TYPE.items():
+                if enemy.type_id == stronger:
+                    masks = self.danger_masks[type_id]
+                    for t, mask in enumerate(layers):
+                        masks[t] |= mask
+
+        for type_id, masks in self.danger_masks.items():
+            danger = self.danger[type_id]
+            danger[:] = self.safe
+            reached = 0
+            for t, mask in enumerate(masks):
+                mask &= ~reached
+                reached |= mask
+                while mask:
+                    low = mask & -mask
+                    danger[low.bit_length() - 1] = t
+                    mask ^= low
+
+    def danger_at(self, type_id, cell):
+        """ Earliest turn an enemy eating `type_id` may be on `cell`, DANGER_HORIZON + 1 when none can """
+        if type_id not in self.danger:
+            return DANGER_HORIZON + 1  # DEAD, nothing eats it
+        return self.danger[type_id][cell[1] * self.maze.w + cell[0]]
+
+    def recent(self):
+        """ Enemies seen this turn or out of sight for at most ENEMY_THREAT_TURNS turns """
+        return [enemy for _, enemy in self.enemies.items() if self.turn_id - enemy.seen_turn <= ENEMY_THREAT_TURNS]
+
+    def hidden(self):
+        """ Recent enemies out of sight this turn """
+        return [enemy for enemy in self.recent() if enemy.seen_turn != self.turn_id]
 
 
 class Maze:
-    def __init__(self,):
-        self.w, self.h = [int(i) for i in input().split()]
-        self.floor_plan = self.parse_map()
-        self.dirs = ['l', 'd', 'r', 'u']
+    def __init__(self, w, h, rows, pellet_map=PelletMap):
+        self.w, self.h = w, h
+        self.floor = self.parse_map(rows)  # cell index -> 1 if floor else 0
+        self.dirs = list(DIRS)
+        self.cells = [(i % self.w, i // self.w) for i in range(self.w * self.h)]  # cell index -> (x, y)
+        self.neighbours = self.construct_neighbours()  # dir -> array of neighbour cell index per cell index
         self.node_count = 0
         self.edge_count = 0
         self.nodes = dict()  # (x, y) -> Node()
         self.edges = dict()  # edge_id -> Edge()
-        self.pellet_dict = dict()  # (x, y) -> pellet value
-        self.total_pellets = 0
-
-    def parse_map(self):
-        # Read in the inputs and store it line-by-line
-        rows = list()
-        for i in range(self.h):
-            rows.append(input())
+        self.cell_edge = dict()  # (x, y) -> (edge_id, index_on_path), node cells map to their first edge
+        self.joint_nodes = set()  # (x, y) of the nodes joining three or more ways
+        self.terminal_nodes = set()  # (x, y) of the dead end nodes
+        self.corridor = None  # cell index -> id of the edge the cell lies strictly inside, -1 elsewhere
+        self.dead_end_depth = None  # cell index -> moves to the joint node closing its terminal edge
+        self.trap = None  # cell index -> 1 if the cell is on no cycle, a pac there has a single way out
+        self.links = None  # cell index -> floor cell indices one move away
+        self.node_searches = dict()  # node id -> (moves, legs) of a Dijkstra search from that node
+        self.node_legs = dict()  # (source node id, target node id) -> [(Edge, from node)] of a shortest route
+        self.floor_cells = [i for i in range(self.w * self.h) if self.floor[i]]  # floor id -> cell index
+        self.floor_id = array('h', [-1] * (self.w * self.h))  # cell index -> floor id, -1 for walls
+        for f, i in enumerate(self.floor_cells):
+            self.floor_id[i] = f
+        self.distances = None  # floor id * floor count + floor id -> path distance
+        self.next_hops = None  # floor id * floor count + floor id -> index in self.dirs of the first step
+        self.visible_masks = None  # cell index -> bitset of cell indices in line of sight
+        self.pellet_dict = pellet_map(self.w, self.h)  # (x, y) -> pellet value, PelletMap or BitsetPelletMap
+        self.pellet_belief = PelletBelief(self.w, self.h)  # (x, y) -> expected pellet value
+        self.region_scores = RegionScores()  # Per turn edge, path and region sums of the expected values
+        self.floor_mask = 0  # bitset of floor cell indices
+        for i in self.floor_cells:
+            self.floor_mask |= 1 << i
+        self.left_column_mask = 0  # bitset of the cell indices with x == 0, they wrap to x == w - 1
+        for y in range(self.h):
+            self.left_column_mask |= 1 << (y * self.w)
+        self.right_column_mask = self.left_column_mask << (self.w - 1)
+        self.enemies = EnemyTracker(self)
 
-        floor_plan = dict()
+    def parse_map(self, rows):
+        # Flatten the rows into a cell index -> is floor array, cell index is y * w + x
+        floor = bytearray(self.w * self.h)
         for y in range(self.h):
             for x in range(self.w):
-                floor_plan[(x, y)] = rows[y][x]
-
-        return floor_plan
+                if rows[y][x] == ' ':
+                    floor[y * self.w + x] = 1
+
+        return floor
+
+    def construct_neighbours(self):
+        # Precompute the neighbour cell index in every direction, with the same wrap rules as the game:
+        # left and right wrap around, up and down stay in place at the border
+        w, h = self.w, self.h
+        neighbours = {dir: array('H', range(w * h)) for dir in self.dirs}
+        for y in range(h):
+            for x in range(w):
+                i = y * w + x
+                neighbours['l'][i] = i - 1 if x > 0 else i + w - 1  # Wrap around the left edge
+                neighbours['r'][i] = i + 1 if x < w - 1 else i - w + 1  # Wrap around the right edge
+                if y > 0:
+                    neighbours['u'][i] = i - w
+                if y < h - 1:
+                    neighbours['d'][i] = i + w
+        return neighbours
 
     @staticmethod
     def inverse_dir(dir):
@@ -90,48 +929,26 @@ class Maze:
         }
         return inverse_dict[dir]
 
+    def index(self, x, y):
+        return y * self.w + x
+
     def is_floor(self, x, y):
-        return self.floor_plan[(x, y)] == ' '
+        return self.floor[y * self.w + x] == 1
 
     def get_coord(self, x, y, dir):
-
-        if dir == 'l':
-            if x == 0:
-                return x + self.w - 1, y  # Wrap around the left edge
-            else:
-                return x - 1, y
-
-        elif dir == 'r':
-            if x == self.w - 1:
-                return 0, y  # Wrap around the right edge
-            else:
-                return x + 1, y
-
-        elif dir == 'u':
-            if y == 0:
-                return x, y  # If at upper edge, return current position
-            else:
-                return x, y - 1
-
-        elif dir == 'd':
-            if y == self.h - 1:
-                return x, y  # If at bottom edge, return current position
-            else:
-                return x, y + 1
-        else:
-            p(f'Invalid direction: {dir}')
+        return self.cells[self.neighbours[dir][y * self.w + x]]
 
     def check_way(self, x, y, dir):
-        return self.is_floor(*self.get_coord(x, y, dir))
+        return self.floor[self.neighbours[dir][y * self.w + x]] == 1
 
     def conn_count(self, x, y):
-        if not self.is_floor(x, y):
+        i = y * self.w + x
+        if not self.floor[i]:
             return 0
 
         count = 0
         for dir in self.dirs:
-            if self.check_way(x, y, dir):
-                count += 1
+            count += self.floor[self.neighbours[dir][i]]
         return count
 
     def get_available_dirs(self, x, y):
@@ -142,32 +959,33 @@ class Maze:
         return available_dirs
 
     def construct_nodes(self):
-        for y in range(self.h):
-            for x in range(self.w):
-                if self.is_floor(x, y):
-                    if self.conn_count(x, y) == 1:
-                        # Create terminal node
-                        self.nodes[(x, y)] = Node(self.node_count, x, y, 'terminal')
-                        self.node_count += 1
-                    elif self.conn_count(x, y) > 2:
-                        # Create joint node
-                        self.nodes[(x, y)] = Node(self.node_count, x, y, 'joint')
-                        self.node_count += 1
+        for i, (x, y) in enumerate(self.cells):
+            if self.floor[i]:
+                conn_count = self.conn_count(x, y)
+                if conn_count == 1:
+                    # Create terminal node
+                    self.nodes[(x, y)] = Node(self.node_count, x, y, 'terminal')
+                    self.node_count += 1
+                elif conn_count > 2:
+                    # Create joint node
+                    self.nodes[(x, y)] = Node(self.node_count, x, y, 'joint')
+                    self.node_count += 1
 
     def _create_edge(self, node, dir):
         # Creates Edge object connecting `node` to a new node found by traversing along the `dir` direction
         # Stores the Edge in self.edges
 
         # New Edge creation
-        e = Edge(self.edge_count, node, dir)
+        e = Edge(self.edge_count, node, DIRS.index(dir))
         self.edges[self.edge_count] = e
         self.edge_count += 1
 
         # Attach this Edge to the current Node's `dir`
-        node[dir] = e
+        node.edges[e.dir1] = e
 
         # Attach the (x, y) of current node as first point in the edge path
         x, y = node.x, node.y
+        self.cell_edge.setdefault((x, y), (e.id, 0))
         e.path.append((x, y))
 
         # Traverse till we find the next node
@@ -181,16 +999,18 @@ class Maze:
                 other_node = self.nodes.get((new_x, new_y))
 
                 # Update edge
+                self.cell_edge.setdefault((new_x, new_y), (e.id, len(e.path)))
                 e.path.append((new_x, new_y))
                 e.node2 = other_node
-                e.dir2 = self.inverse_dir(this_dir)
+                e.dir2 = DIRS.index(self.inverse_dir(this_dir))
                 e.length = len(e.path)
 
                 # Update the other node for this new Edge connection
-                other_node[self.inverse_dir(this_dir)] = e
+                other_node.edges[e.dir2] = e
                 break
 
-            # Append new x, y to path, update x, y
+            # Append new x, y to path, index it, update x, y
+            self.cell_edge[(new_x, new_y)] = (e.id, len(e.path))
             e.path.append((new_x, new_y))
 
             x, y = new_x, new_y
@@ -210,78 +1030,301 @@ class Maze:
         for key in self.nodes:
             x, y = key
             node = self.nodes.get(key)
-            traversible_dirs = [dir for dir in self.dirs  # l, r, u, d
+            traversible_dirs = [dir for k, dir in enumerate(self.dirs)  # l, d, r, u
                                 if self.check_way(x, y, dir)  # Only directions without wall
-                                and node[dir] is None]  # Only directions not assigned an Edge yet
+                                and node.edges[k] is None]  # Only directions not assigned an Edge yet
 
             for dir in traversible_dirs:
                 self._create_edge(node, dir)
+
+        for _, e in self.edges.items():
+            for x, y in e.path[1:-1]:
+                e.mask |= 1 << (y * self.w + x)
+
+        self.pellet_dict.index_edges(self.edges)
+        self.pellet_belief.index_edges(self.edges)
+        self.region_scores.index_edges(self.edges, self.w)
         return
 
+    def construct_topology(self):
+        # Static per cell facts for the chase and escape logic, run after `construct_edges`
+        size = self.w * self.h
+        self.joint_nodes = {cell for cell, node in self.nodes.items() if node.type == 'joint'}
+        self.terminal_nodes = {cell for cell, node in self.nodes.items() if node.type == 'terminal'}
+
+        # Dead end depth is 0 off terminal edges and UNREACHABLE on a corridor closed at both ends
+        self.corridor = array('h', [-1]) * size
+        self.dead_end_depth = array('H', [0]) * size
+        for _, e in self.edges.items():
+            for x, y in e.path[1:-1]:
+                self.corridor[y * self.w + x] = e.id
+            if e.node1.type == 'terminal' and e.node2.type == 'terminal':
+                for x, y in e.path:
+                    self.dead_end_depth[y * self.w + x] = UNREACHABLE
+            elif e.node1.type == 'terminal' or e.node2.type == 'terminal':
+                for index, (x, y) in enumerate(e.path):
+                    self.dead_end_depth[y * self.w + x] = e.length - 1 - index if e.node1.type == 'terminal' else index
+
+        # Peel cells with a single way out until only the cycles are left
+        links = [{self.neighbours[dir][i] for dir in self.dirs if self.floor[self.neighbours[dir][i]]} - {i}
+                 if self.floor[i] else set() for i in range(size)]
+        self.links = [tuple(sorted(linked)) for linked in links]
+        degree = [len(linked) for linked in links]
+        self.trap = bytearray(size)
+        peel = deque(i for i in self.floor_cells if degree[i] <= 1)
+        while peel:
+            i = peel.popleft()
+            if self.trap[i]:
+                continue
+            self.trap[i] = 1
+            for j in links[i]:
+                if not self.trap[j]:
+                    degree[j] -= 1
+                    if degree[j] <= 1:
+                        peel.append(j)
+
+    def construct_distances(self):
+        # Breadth first search from every floor cell over the neighbour tables, storing the all pairs
+        # path distance and the direction of the first step towards the target in flat arrays
+        floor_count = len(self.floor_cells)
+        adjacency = list()  # floor id -> [(neighbour floor id, dir index)]
+        for i in self.floor_cells:
+            adjacency.append([(self.floor_id[self.neighbours[dir][i]], k) for k, dir in enumerate(self.dirs)
+                              if self.floor[self.neighbours[dir][i]] and self.neighbours[dir][i] != i])
+
+        distances = array('H', [UNREACHABLE]) * (floor_count * floor_count)
+        next_hops = bytearray([NO_HOP]) * (floor_count * floor_count)
+        for source in range(floor_count):
+            dist = [UNREACHABLE] * floor_count
+            hop = [NO_HOP] * floor_count
+            dist[source] = 0
+            frontier = list()
+            for f, k in adjacency[source]:
+                if dist[f] == UNREACHABLE:
+                    dist[f] = 1
+                    hop[f] = k
+                    frontier.append(f)
+            d = 1
+            while frontier:
+                d += 1
+                new_frontier = list()
+                for f in frontier:
+                    for g, _ in adjacency[f]:
+                        if dist[g] == UNREACHABLE:
+                            dist[g] = d
+                            hop[g] = hop[f]
+                            new_frontier.append(g)
+                frontier = new_frontier
+
+            offset = source * floor_count
+            distances[offset:offset + floor_count] = array('H', dist)
+            next_hops[offset:offset + floor_count] = bytes(hop)
+
+        self.distances = distances
+        self.next_hops = next_hops
+
+    def distance(self, a, b):
+        """ Shortest path distance between cells `a` and `b`, UNREACHABLE if there is no path """
+        fa, fb = self.floor_id[a[1] * self.w + a[0]], self.floor_id[b[1] * self.w + b[0]]
+        return self.distances[fa * len(self.floor_cells) + fb]
+
+    def next_cell(self, a, b):
+        """ First cell on a shortest path from `a` to `b`, `a` itself if already there or unreachable """
+        i = a[1] * self.w + a[0]
+        hop = self.next_hops[self.floor_id[i] * len(self.floor_cells) + self.floor_id[b[1] * self.w + b[0]]]
+        if hop == NO_HOP:
+            return a
+        return self.cells[self.neighbours[self.dirs[hop]][i]]
+
+    def path(self, a, b):
+        """ Cells of a shortest path from `a` to `b`, both included, only `a` if `b` is unreachable """
+        cells = [a]
+        while cells[-1] != b:
+            cell = self.next_cell(cells[-1], b)
+            if cell == cells[-1]:
+                break
+            cells.append(cell)
+        return cells
+
+    def search_nodes(self, source):
+        """ Dijkstra over the Node / Edge graph from `source`, weighted by the moves along each edge
+
+        Returns (moves, legs), node id -> moves from `source` (UNREACHABLE if none) and node id -> (Edge,
+        from node) of the last leg of a shortest route. The graph does not change, so searches are cached.
+        """
+        if source.id in self.node_searches:
+            return self.node_searches[source.id]
+
+        moves = [UNREACHABLE] * self.node_count
+        legs = [None] * self.node_count
+        moves[source.id] = 0
+        heap = [(0, source.id, source)]
+        while heap:
+            d, node_id, node = heapq.heappop(heap)
+            if d > moves[node_id]:
+                continue
+            for e in node.edges:
+                if e is None:
+                    continue
+                other = e.other_node(node)
+                if d + e.length - 1 < moves[other.id]:
+                    moves[other.id] = d + e.length - 1
+                    legs[other.id] = (e, node)
+                    heapq.heappush(heap, (moves[other.id], other.id, other))
+
+        self.node_searches[source.id] = (moves, legs)
+        return moves, legs
+
+    def node_route(self, source, target):
+        """ [(Edge, from node)] legs of a shortest route between two nodes, None if `target` is unreachable """
+        key = (source.id, target.id)
+        if key not in self.node_legs:
+            moves, legs = self.search_nodes(source)
+            route = None
+            if moves[target.id] != UNREACHABLE:
+                route = list()
+                node = target
+                while node is not source:
+                    e, node = legs[node.id]
+                    route.append((e, node))
+                route.reverse()
+            self.node_legs[key] = route
+        return self.node_legs[key]
+
+    def node_distance(self, cell, target):
+        """ (moves, end node) of a shortest way from `cell` to the node `target`, leaving an edge by `end` """
+        node = self.nodes.get(cell)
+        if node is not None:
+            return self.search_nodes(node)[0][target.id], node
+        e, index = self.get_edge(*cell)
+        if e is None:
+            return UNREACHABLE, None  # A loop without junctions
+        return min((index + self.search_nodes(e.node1)[0][target.id], e.node1),
+                   (e.length - 1 - index + self.search_nodes(e.node2)[0][target.id], e.node2),
+                   key=lambda option: option[0])
+
+    def route_to_node(self, cell, target):
+        """ Route from `cell`, on a node or in the middle of an edge, to the node `target` along a shortest way
+        over the Node / Edge graph, stitched from views of the edge paths. None if `target` is unreachable
+        """
+        moves, end = self.node_distance(cell, target)
+        if moves >= UNREACHABLE:
+            return None
+
+        route = Route()
+        if cell == (end.x, end.y):
+            route.append([cell])
+        else:
+            e, index = self.get_edge(*cell)
+            if end is e.node1:
+                route.append(e.path, index, index + 1, -1)
+            else:
+                route.append(e.path, index, e.length - index, 1)
+        for e, from_node in self.node_route(end, target):
+            route.append_edge(e, from_node, 1)
+        return route
+
+    def get_edge(self, x, y):
+        """ Returns (Edge, index_on_path) of the edge holding the cell, or (None, None) if it is on no edge """
+        try:
+            edge_id, index = self.cell_edge[(x, y)]
+        except KeyError:
+            return None, None
+        return self.edges[edge_id], index
+
+    @property
+    def total_pellets(self):
+        return self.pellet_dict.total
+
     def update_pellet_values(self):
-        self.total_pellets = 0
-        for edge_id in self.edges:
-            e = self.edges[edge_id]
-            pellets = 0
-            for point in e.path:
-                try:
-                    pellets += self.pellet_dict[point]
-                    self.total_pellets += self.pellet_dict[point]
-                except KeyError:
-                    # p(f"Keyerror for pellet value update for {point}")
-                    pass
-            e.pellets = pellets
+        # Rebuild every edge pellet total from scratch, `update_pellet_map` keeps them current afterwards
+        self.pellet_dict.recount()
+
+    def get_visible_indices(self, i):
+        # Get visible cell indices from cell index `i` by walking the neighbour tables until a wall
+        visible = [i]
+        floor = self.floor
+        for dir in self.dirs:
+            neighbour = self.neighbours[dir]
+            j = neighbour[i]
+            while floor[j] and j != i:
+                visible.append(j)
+                j = neighbour[j]
+        return visible
+
+    def construct_visibility(self):
+        # Cache the line of sight of every floor cell as a bitset of cell indices
+        visible_masks = [0] * (self.w * self.h)
+        for i in self.floor_cells:
+            mask = 0
+            for j in self.get_visible_indices(i):
+                mask |= 1 << j
+            visible_masks[i] = mask
+        self.visible_masks = visible_masks
+
+    def get_visible_mask(self, cells):
+        """ Bitset of cell indices visible from any of the (x, y) `cells` """
+        mask = 0
+        for x, y in cells:
+            mask |= self.visible_masks[y * self.w + x]
+        return mask
+
+    def expand_mask(self, mask, steps=1):
+        """ Bitset of the floor cells at most `steps` moves away from a cell in the `mask` bitset """
+        w = self.w
+        for _ in range(steps):
+            mask |= (mask >> w) | (mask << w) \
+                | ((mask & ~self.left_column_mask) >> 1) | ((mask & self.left_column_mask) << (w - 1)) \
+                | ((mask & ~self.right_column_mask) << 1) | ((mask & self.right_column_mask) >> (w - 1))
+            mask &= self.floor_mask
+        return mask
+
+    def update_pellet_belief(self, turn_id, opponent_score, visible_pellets, my_pacs):
+        # Run after `update_pellet_map` and the enemy tracker update
+        if turn_id == 0:
+            self.pellet_belief.reset([self.pellet_dict[cell] for cell in self.cells])
+            self.pellet_belief.opponent_score = opponent_score
+            return
+
+        visible_mask = self.get_visible_mask([(pac.x, pac.y) for _, pac in my_pacs.items()])
+        self.pellet_belief.update(opponent_score, self.pellet_dict, visible_pellets, self.floor_mask & ~visible_mask,
+                                  self.enemies)
 
     def get_visible_cells(self, x, y):
         # Get visible cells from (x, y) in maze
-        visible_cells = list()
-        visible_cells.append((x, y))
-
-        for dir in self.get_available_dirs(x, y):
-            x0, y0 = x, y
-            while self.check_way(x0, y0, dir):
-                x0, y0 = self.get_coord(x0, y0, dir)
-                visible_cells.append((x0, y0))
-        return visible_cells
-
-    def get_diagonal_cells(self, x, y):
-        p1 = self.get_coord(*self.get_coord(x, y, 'r'), 'u')  # Right Up
-        p2 = self.get_coord(*self.get_coord(x, y, 'l'), 'u')  # Left Up
-        p3 = self.get_coord(*self.get_coord(x, y, 'r'), 'd')  # Right Down
-        p4 = self.get_coord(*self.get_coord(x, y, 'l'), 'd')  # Left Down
-        points = [p for p in [p1, p2, p3, p4] if self.is_floor(*p)]
-        return points
-
-    def update_pellet_map(self, turn_id, visible_pellet_dict, my_pacs):
+        return [self.cells[i] for i in self.get_visible_indices(y * self.w + x)]
+
+    def update_pellet_map(self, turn_id, visible_pellets, my_pacs):
+        pellets = self.pellet_dict
 
         if turn_id == 0:
             # Assume all floor cells have pellets
-            pellet_dict = {cell: 1 for cell, value in self.floor_plan.items() if value == ' '}  # Cell is (x, y) tuple
-
-            # Update superpellets from `visible_pellet_dict`
-            super_pellets = {cell: value for cell, value in visible_pellet_dict.items() if value > 1}
-            pellet_dict.update(super_pellets)
-            self.pellet_dict = pellet_dict
+            values = bytearray(self.floor)
 
-        else:
-            # Get set of all cells visible to all pacs and subtract the cells in which you saw a pellet
-            # Resulting set of points don't have any pellets. Update these points in the pellet map
+            # Update superpellets from `visible_pellets`
+            for x, y, value in visible_pellets:
+                if value > 1:
+                    values[y * self.w + x] = value
 
-            all_visible_cells = set()
-            for _, pac in my_pacs.items():
-                all_visible_cells = all_visible_cells.union(set(maze.get_visible_cells(pac.x, pac.y)))
+            pellets.reset(values)
 
-            visible_pellet_cells = set([cell for cell, value in visible_pellet_dict.items()])
+        else:
+            # Get all cells visible to all pacs and remove the cells in which you saw a pellet
+            # Resulting points don't have any pellets. Update these points in the pellet map
+            visible_pellet_mask = 0
+            for x, y, _ in visible_pellets:
+                visible_pellet_mask |= 1 << (y * self.w + x)
 
-            no_pellet_cells = all_visible_cells - visible_pellet_cells
-            no_pellet_dict = {cell: 0 for cell in no_pellet_cells}
+            visible_mask = self.get_visible_mask([(pac.x, pac.y) for _, pac in my_pacs.items()])
 
-            curr_pellet_dict = self.pellet_dict
-            curr_pellet_dict.update(no_pellet_dict)
-            self.pellet_dict = curr_pellet_dict
+            # Super pellets are always visible, so a missing one has been eaten
+            pellets.clear_mask((visible_mask | pellets.super_mask) & ~visible_pellet_mask)
 
 
 class Pac:
+    __slots__ = ('id', 'x', 'y', 'last_x', 'last_y', 'type_id', 'speed_turns_left', 'ability_cooldown', 'maze', 'con',
+                 'debug', 'stuck_counter', 'travel_queue', 'planned_steps', 'accepting_commands')
+
     def __init__(self, id, x, y, type_id, speed_turns_left, ability_cooldown, maze, con):
         self.id = id
         self.x = x
@@ -293,13 +1336,10 @@ class Pac:
         self.ability_cooldown = ability_cooldown
         self.maze = maze
         self.con = con
-        self.my_pacs = None
-        self.en_pacs = None
         self.debug = False
         self.stuck_counter = 0  # If stays at same location for 3 moves, reverse travel direction
-        self.recursion_counter = 0
-        self.travel_queue = list()
-        self.stronger_type = {'ROCK': 'PAPER', 'PAPER': 'SCISSORS', 'SCISSORS': 'ROCK'}
+        self.travel_queue = Route()  # Its cursor is on the pac's cell
+        self.planned_steps = list()  # Cells this turn's MOVE passes through, two under SPEED, settled by the Controller
         self.accepting_commands = True
 
     def _move(self, x, y):
@@ -315,146 +1355,109 @@ class Pac:
         return self._move(self.x, self.y)
 
     def distance(self, x, y):
-        return abs(self.x - x) + abs(self.y - y)
-
-    def get_current_index(self):
-        return len(self.travel_queue) - 1 - self.travel_queue[::-1].index((self.x, self.y))
+        return self.maze.distance((self.x, self.y), (x, y))
 
-    def get_next_cell(self):
+    def advance_cursor(self):
+        """ Moves the travel queue cursor forward to the pac's new cell, a move covers at most two cells
 
-        if self.accepting_commands and self.recursion_counter >= 4:
-            p(f'Pac({self.id}) hit recursion in get_next_cell')
-            self.accepting_commands = False
-            return self.get_next_cell()
-
-        if self.accepting_commands and not self.travel_queue:
-            new_queue = self.con.strategy(self)
-            self.set_travel_queue(new_queue)
-            if self.debug: p(f'No travel queue, new queue: {new_queue}')
-            self.recursion_counter += 1
-            return self.get_next_cell()
-
-        current_index = self.get_current_index()
-
-        if not self.accepting_commands and current_index != len(self.travel_queue) - 1:
-            if self.debug: p('Previously hit recursion, travelling one step towards travel queue')
-            return self.travel_queue[current_index + 1]
-
-        if self.accepting_commands and current_index == len(self.travel_queue) - 2:  # At second last element
-            if self.debug: p('At second last element in travel queue')
-
-            if self.speed_turns_left > 0:
-
-                this_queue = self.travel_queue
-                this_queue_final_node_cell = this_queue[-1]
-                pac_copy = copy.deepcopy(self)
-                pac_copy.x, pac_copy.y = this_queue_final_node_cell
-                new_queue = self.con.strategy(pac_copy)
-                # final_queue = this_queue + new_queue if this_queue[-1] != new_queue[0] else this_queue + new_queue[1:]
-                final_queue = this_queue + new_queue
-                self.set_travel_queue(final_queue)
-                self.recursion_counter += 1
-                if self.debug: p(f'this_queue: {this_queue} | new_queue: {new_queue} | final: {final_queue}')
-                return self.get_next_cell()
-
-            # Speed is off
-            else:
-                if self.debug: p('At second last element and speed off, so one travel one step')
-                return self.travel_queue[current_index + 1]
-
-        if current_index == len(self.travel_queue) - 1:  # At last element
+        Drops the queue when the pac is not on it any more, e.g. after being blocked off its route.
+        """
+        cell = (self.x, self.y)
+        queue = self.travel_queue
+        for i in range(queue.cursor, min(queue.cursor + 3, len(queue))):
+            if queue[i] == cell:
+                queue.cursor = i
+                return
+
+        if queue:
+            p(f'Pac({self.id}) left its travel queue')
+        self.travel_queue = Route()
+        self.accepting_commands = True
 
+    def queue_from(self, cell, queue):
+        """ `queue` with its cursor on `cell`, joined to it by a shortest path when `cell` is not on it """
+        if not queue:
+            return Route([cell])
+        i = queue.find(cell)
+        if i >= 0:
+            queue.cursor = i
+            return queue
+        path = self.maze.path(cell, queue[0])
+        if path[-1] != queue[0]:
+            return Route([cell])
+        route = Route(path)
+        route.extend(queue, 1)
+        return route
+
+    def plan(self, cell):
+        """ Travel queue starting at `cell` as planned by the Controller, the pac itself is left untouched """
+        return self.queue_from(cell, self.con.strategy(self, cell))
+
+    def extend_travel_queue(self):
+        """ Plans until the travel queue holds this turn's move, one cell ahead or two under SPEED """
+        steps = 2 if self.speed_turns_left > 0 else 1
+
+        if self.travel_queue.cursor >= len(self.travel_queue) - 1:  # At last element
             self.accepting_commands = True
-            new_queue = self.con.strategy(self)
-            self.set_travel_queue(new_queue)
-            self.recursion_counter = 0
-            self.recursion_counter += 1
-            if self.debug: p(f'At last element. New queue: {new_queue}')
-            return self.get_next_cell()
-
-        # Self not at last two cells of travel queue
-        else:
-            if self.debug: p('Not at last two elements of travel queue')
-            if self.speed_turns_left > 0:
-                self.recursion_counter = 0
-                self.accepting_commands = True
-                if self.debug: p('Speed on, jumping 2 cells')
-                return self.travel_queue[current_index + 2]
-
-            # Speed is off
-            else:
-                if self.debug: p('Speed off, jumping 1 cell')
-                self.recursion_counter = 0
-                self.accepting_commands = True
-                return self.travel_queue[current_index + 1]
-
-    def get_next_cell_old(self):
-
-        if not self.travel_queue:
-            new_queue = self.con.simple_greedy_edge(self)
-            self.set_travel_queue(new_queue)
-            if self.debug: p(f'Game start, no next cell to fetch, new queue: {new_queue}')
-
-        current_index = self.get_current_index()
-
-        if self.debug: p(f'Fetching next cell, current index: {current_index} in {self.travel_queue}')
-
-        # When using speed
-        if self.speed_turns_left > 0:
-
-            if self.debug: p('Speed is on so moving two cells')
-
-            # If remaining travel queue is less or equal to two steps, move slowly
-            if len(self.travel_queue[current_index:]) <= 2:
-                return self.travel_queue[current_index + 1]
-
-            # If less than 2 distance away from final node in travel_queue, append remaining cells and a new queue
-            if current_index >= len(self.travel_queue) - 2:
-                if self.debug: p(f'Current index is length of queue - 1 or -2')
-
-                this_queue = self.travel_queue
-                this_queue_final_node_cell = this_queue[-1]
-
-                pac_copy = copy.deepcopy(self)
-                pac_copy.x, pac_copy.y = this_queue_final_node_cell
-                new_queue = self.con.simple_greedy_edge(pac_copy)
-                final_queue = this_queue + new_queue if this_queue[-1] != new_queue[0] else this_queue + new_queue[1:]
-
-                if self.debug: p(f'this_queue: {this_queue} | new_queue: {new_queue} | final: {final_queue}')
-                self.set_travel_queue(final_queue)
-                current_index = self.get_current_index()
-
-            # Move to two cell forward
-            return self.travel_queue[current_index + 2]
-
-        # When not using speed
-        else:
-            if self.debug: p('Speed is off so moving one cell')
-            # If already at destination, stay at same location (also become receptive to commands)
-            if current_index == len(self.travel_queue) - 1:
-                self.accepting_commands = True
-                self.set_travel_queue(self.con.simple_greedy_edge(self))
-                return self.get_next_cell()
+            self.set_travel_queue(self.con.strategy(self))
+            if self.debug: p(f'At last element. New queue: {self.travel_queue}')
+
+        queue = self.travel_queue
+        ahead = len(queue) - 1 - queue.cursor
+        if self.accepting_commands and 0 < ahead < steps:
+            # At second last element under SPEED, chain a queue planned from the end of this one
+            new_queue = self.plan(queue[-1])
+            if len(new_queue) - new_queue.cursor > 1:
+                queue.drop_travelled()
+                queue.extend(new_queue, new_queue.cursor + 1)
+                self.con.claim_travel_queue(self)
+                if self.debug: p(f'new_queue: {new_queue} | final: {queue}')
+
+    def upcoming_cells(self):
+        """ Cells this turn's move passes through, read from the travel queue without planning """
+        steps = 2 if self.speed_turns_left > 0 else 1
+        cells = self.travel_queue.ahead(steps)
+
+        # The referee walks a shortest path to the MOVE target, so a second step turning back would cancel the move
+        if len(cells) == 2 and self.maze.distance((self.x, self.y), cells[1]) < 2:
+            cells = cells[:1]
+        return cells
 
-            # Move forward
-            return self.travel_queue[current_index + 1]
+    def get_next_cell(self):
+        """ Cell this turn's MOVE ends on """
+        cells = self.upcoming_cells()
+        return cells[-1] if cells else (self.x, self.y)
 
     def set_travel_queue(self, queue):
-        if len(self.travel_queue) > 30:
-            p(f'Pac({self.id}) travel queue too long')
-            p(f'{self.travel_queue}')
-            self.travel_queue = []
-            self.set_travel_queue(self.con.strategy(self))
-            return
+        """ Replaces the travel queue and puts the cursor on the pac's cell, unless locked on a chase
 
-        if self.accepting_commands:
-            self.travel_queue = queue
+        The cells behind the pac are kept so that reversing the queue retreats along them.
+        """
+        if not self.accepting_commands:
             return
 
-        return
+        cell = (self.x, self.y)
+        cursor = queue.find(cell, last=True) if queue else -1  # Last visit, a queue looping back here is cut short
+        if cursor >= 0:
+            queue.cursor = cursor
+        else:
+            queue = self.queue_from(cell, queue)
+        self.travel_queue = queue
+        self.limit_travel_queue()
+        self.con.claim_travel_queue(self)
+
+    def limit_travel_queue(self):
+        queue = self.travel_queue
+        if len(queue) - queue.cursor > MAX_TRAVEL_QUEUE:
+            p(f'Pac({self.id}) travel queue too long, keeping its next {MAX_TRAVEL_QUEUE} cells')
+            queue.truncate(queue.cursor + MAX_TRAVEL_QUEUE)
 
     def reverse_travel_queue(self):
-        self.set_travel_queue(list(reversed(self.travel_queue)))
+        """ Turns back along the travel queue, the cells behind the pac become the ones ahead """
+        if not self.accepting_commands:
+            return
+        self.travel_queue.reverse()
+        self.limit_travel_queue()
 
     def follow_travel_queue(self):
         """ If self in mid of current travel queue, follow it
@@ -470,11 +1473,57 @@ class Pac:
         if self.stuck_counter > 0:
             self.reverse_travel_queue()
 
+        self.extend_travel_queue()
+
+        # Record the cells passed on the way for the reservation table
+        self.planned_steps = self.upcoming_cells()
+
         return self._move(*self.get_next_cell())
 
+    def encounter_command(self, action, arg):
+        """ Command for an action of the encounter evaluator, a MOVE along the travel queue follows it """
+        self.con.opening.pop(self.id, None)
+        if action == 'SPEED':
+            return self._speed()
+        if action == 'SWITCH':
+            return self._switch(arg)
+
+        cells = [self.maze.cells[i] for i in arg]
+        if not cells:
+            return self.stay()
+        if self.travel_queue.ahead(len(cells)) == cells and self.upcoming_cells() == cells:
+            return self.follow_travel_queue()
+        self.planned_steps = cells
+        return self._move(*cells[-1])
+
+    def escape_route(self, en_pac):
+        """ Route along an edge leaving the pac's joint node away from `en_pac`, None when every edge closes in
+
+        Edges the enemy stands inside or whose first cell gets closer to it are left out, then edges whose
+        first cell is no trap come first, so the pac keeps a second way out, and pellets break ties.
+        """
+        maze = self.maze
+        node = maze.nodes[(self.x, self.y)]
+        enemy = (en_pac.x, en_pac.y)
+        enemy_corridor = maze.corridor[maze.index(*enemy)]
+        best, best_key = None, None
+        for e in node.edges:
+            if e is None or e.id == enemy_corridor:
+                continue
+            first = e.path[1] if e.node1 == node else e.path[-2]
+            if maze.distance(first, enemy) < maze.distance((self.x, self.y), enemy):
+                continue
+            key = (not maze.trap[maze.index(*first)], self.con.edge_pellets(self, e))
+            if best_key is None or key > best_key:
+                best, best_key = e, key
+        return Route.along(best, node) if best is not None else None
+
     def enemy_routine(self, en_pacs):
         """ Decide what to do if an enemy is in 2 distance vicinity """
 
+        # The race for super pellets is off once enemies are this close
+        self.con.opening.pop(self.id, None)
+
         # If surrounded by more than 2 enemy pacs, stay
         # WIP: Write a better approach
         if len(en_pacs) > 1:
@@ -483,8 +1532,6 @@ class Pac:
         en_pac, en_dist = list(en_pacs.keys())[0], list(en_pacs.values())[0]
 
         # Calculate some decision variables used in logic
-        joint_node_cells = [cell for cell, node in self.maze.nodes.items() if node.type == 'joint']
-
         on_edge = True if (self.x, self.y) not in self.maze.nodes else False
 
         current_edge = None
@@ -492,22 +1539,16 @@ class Pac:
         on_joint_node = None
 
         if on_edge:
-            for _, e in self.maze.edges.items():
-                if (self.x, self.y) in e.path:
-                    current_edge = e
-                    break
+            current_edge, _ = self.maze.get_edge(self.x, self.y)
 
-            n1, n2 = current_edge.node1, current_edge.node2
-            if 'terminal' in [n1.type, n2.type]:
-                on_terminal_edge = True
-            else:
-                on_terminal_edge = False
+            # Off terminal edges, including loops without junctions, the depth is 0
+            on_terminal_edge = self.maze.dead_end_depth[self.maze.index(self.x, self.y)] > 0
 
         # Self on a node
         else:
 
             # Self on joint node
-            if (self.x, self.y) in joint_node_cells:
+            if (self.x, self.y) in self.maze.joint_nodes:
                 on_joint_node = True
 
             # Self on terminal node
@@ -518,7 +1559,7 @@ class Pac:
         if self.debug: p(f'on_edge: {on_edge} on_terminal_edge: {on_terminal_edge} on_joint_node: {on_joint_node}')
 
         # If enemy is stronger
-        if en_pac.type_id == self.stronger_type[self.type_id]:
+        if en_pac.type_id == STRONGER_TYPE[self.type_id]:
 
             if self.debug: p(f'Enemy strong')
 
@@ -542,7 +1583,7 @@ class Pac:
 
                             if self.debug: p(f'Changing to stronger type')
 
-                            return self._switch(self.stronger_type[en_pac.type_id])
+                            return self._switch(STRONGER_TYPE[en_pac.type_id])
 
                         # You are trapped and can do nothing. Wait for your doom.
                         else:
@@ -588,9 +1629,10 @@ class Pac:
                     return self.follow_travel_queue()
 
             elif on_joint_node:
-                if self.debug: p('On joint node, getting new edge greedily from inside play func')
-                # TODO: Handle in optimization, should not need to construct this case here
-                new_queue = self.con.simple_greedy_edge(self)
+                if self.debug: p('On joint node, leaving by the best escape edge')
+                new_queue = self.escape_route(en_pac)
+                if new_queue is None:
+                    new_queue = self.con.simple_greedy_edge(self, (self.x, self.y), self.travel_queue)
                 if self.debug: p(f'New queue: {new_queue}')
                 self.set_travel_queue(new_queue)
                 return self.follow_travel_queue()
@@ -614,11 +1656,8 @@ class Pac:
             if self.debug: p('Enemy weaker')
 
             # If enemy on edge
-            if (en_pac.x, en_pac.y) not in self.maze.nodes:
-                for _, e in self.maze.edges.items():
-                    if (en_pac.x, en_pac.y) in e.path:
-                        current_edge = e
-                        break
+            current_edge, _ = self.maze.get_edge(en_pac.x, en_pac.y)
+            if (en_pac.x, en_pac.y) not in self.maze.nodes and current_edge is not None:
 
                 n1, n2 = current_edge.node1, current_edge.node2
 
@@ -636,7 +1675,7 @@ class Pac:
 
                         if self.debug: p('Enemy trapped')
 
-                        self.set_travel_queue(current_edge.path if n2.type == 'terminal' else list(reversed(current_edge.path)))
+                        self.set_travel_queue(Route.along(current_edge, n1 if n2.type == 'terminal' else n2))
                         self.accepting_commands = False
 
                         if self.debug: p(f'Kill travel queue: {self.travel_queue}')
@@ -654,7 +1693,7 @@ class Pac:
                     if self.debug: p('Enemy not on terminal edge, continuing')
                     return self.follow_travel_queue()
 
-            # If enemy on node
+            # If enemy on a node, or on a loop without junctions
             else:
 
                 if self.debug: p('Enemy on a node, continuining')
@@ -662,37 +1701,44 @@ class Pac:
 
     def play(self):
         """ Follows a mostly defensive strategy returning the next command """
+        self.planned_steps = list()
+
+        # Out of time for this turn, skip the vicinity checks and keep moving
+        if self.con.timer.expired():
+            p(f'Pac({self.id}) out of turn budget, following travel queue')
+            return self.follow_travel_queue()
 
         en_cell_dict = {}
-        if self.en_pacs:
-            en_pac_locs = [(pac.x, pac.y) for _, pac in self.en_pacs.items()]
-            # Get 2 distance squares in each available dir
-            dist = 0
-            en_cell_dict = {}
-            l, r, u, d = (self.x, self.y), (self.x, self.y), (self.x, self.y), (self.x, self.y)
-            while dist < 2:
-                dist += 1
-                l = self.maze.get_coord(*l, 'l')
-                r = self.maze.get_coord(*r, 'r')
-                u = self.maze.get_coord(*u, 'u')
-                d = self.maze.get_coord(*d, 'd')
-
-                for cell in [l, r, u, d]:
-                    if cell in en_pac_locs:
-                        # Get enemy pac in the cell
-                        en_pac = [pac for _, pac in self.en_pacs.items() if (pac.x, pac.y) == cell][0]
-                        en_cell_dict[en_pac] = dist
-
-        diag_cells = self.maze.get_diagonal_cells(self.x, self.y)
-        my_pacs_on_diags = [pac for _, pac in self.my_pacs.items() if (pac.x, pac.y) in diag_cells]
-
-        if self.debug: p(f'Pac({self.x}, {self.y}) | en_cell_dict: {len(en_cell_dict)} | my_pacs_on_diags: {len(my_pacs_on_diags)}')
+        if self.maze.enemies.visible:
+            # Get enemy pacs within 2 path distance, dead ones are still reported
+            for _, en_pac in self.maze.enemies.visible.items():
+                if en_pac.type_id == 'DEAD':
+                    continue
+                dist = self.distance(en_pac.x, en_pac.y)
+                if 0 < dist <= 2:
+                    en_cell_dict[en_pac] = dist
+
+        # Enemies eating us that just left our sight may still be around the corner, at their closest possible cell
+        if self.maze.enemies.danger_at(self.type_id, (self.x, self.y)) <= 2:
+            for enemy in self.maze.enemies.hidden():
+                if enemy.type_id != STRONGER_TYPE.get(self.type_id):
+                    continue
+                closest = enemy.closest_cell((self.x, self.y))
+                if closest is not None and 0 < closest[0] <= 2:
+                    en_cell_dict[enemy.at(closest[1])] = closest[0]
+
+        if self.debug: p(f'Pac({self.x}, {self.y}) | en_cell_dict: {len(en_cell_dict)}')
 
         # Enemy pac 1 or 2 distance away
         if en_cell_dict:
 
             if self.debug: p(f'Enemy pac close')
 
+            # Play the encounter out when there is time, the decision tree below is the fallback
+            decision = self.con.encounters.evaluate(self, en_cell_dict)
+            if decision is not None:
+                return self.encounter_command(*decision)
+
             if min(en_cell_dict.values()) == 2:
                 if self.ability_cooldown == 0:
                     if self.debug: p('Enemy close but still 2 distance away, using speed')
@@ -705,192 +1751,744 @@ class Pac:
                 if self.debug: p('Enemy only 1 distance away, following enemy routine')
                 return self.enemy_routine(en_cell_dict)
 
-        # Friendly pac on diagonal cell
-        elif my_pacs_on_diags:
+        # Normal operation, no enemies in vicinity, friendly collisions are settled by the Controller
+        else:
 
-            if self.debug: p(f'My pacs on diags')
+            if self.debug: p(f'Normal operation')
 
-            if self.ability_cooldown == 0:
-                if self.debug: p(f'Pac on diag, but using speed first')
+            if self.ability_cooldown == 0 and self.con.may_speed(self):
+                if self.debug: p('Normal operation and using speed')
                 return self._speed()
             else:
-                next_cells_diag_pacs = [pac.get_next_cell() for pac in my_pacs_on_diags]
-
-                # If collision about to happen
-                if self.get_next_cell() in next_cells_diag_pacs:
 
-                    if self.debug: p('Can collide')
+                if self.debug: p(f'Normal operation, following travel queue')
 
-                    # If self id greater than all diag pacs, take right of way
-                    if self.id > max([pac.id for pac in my_pacs_on_diags]):
+                return self.follow_travel_queue()
 
-                        if self.debug: p(f'Taking right of way')
 
-                        return self.follow_travel_queue()
+class EncounterEvaluator:
+    """ Monte Carlo rollouts of a pac's encounter with the enemies close to it
+
+    Every candidate action (MOVE one cell, or two cells under SPEED, stay, SPEED or SWITCH) is played out
+    ROLLOUT_DEPTH turns against sampled enemy responses: enemies mostly chase the pacs they eat, flee the
+    ones eating them and switch to the eating type when they can, the rest of the time they wander. After
+    its first action the pac flees threats, chases prey or eats. Rollouts score expected pellets, kills and
+    the pac's death.
+    State lives in buffers allocated once per maze, the rollouts only write into them.
+    """
+
+    def __init__(self, timer, seed=0):
+        self.timer = timer
+        self.rnd = random.Random(seed)
+        self.maze = None
+        self.eaten = None  # cell index -> stamp of the last rollout the pac ate the cell in
+        self.stamp = 0
+        self.en_cell = array('H', [0]) * 8
+        self.en_prev = array('H', [0]) * 8
+        self.en_type = bytearray(8)  # Index in TYPES
+        self.en_speed = bytearray(8)
+        self.en_cooldown = bytearray(8)
+        self.en_alive = bytearray(8)
+        self.en_steps = bytearray(8)  # Moves left to the enemy in the turn being played out
+        self.actions = list()  # Candidate actions of the pac being evaluated
+        self.totals = array('d', [0.0]) * self.MAX_ACTIONS  # Rollout value sums by candidate action
+
+    TYPES = ('ROCK', 'PAPER', 'SCISSORS')
+    TYPE_INDEX = {type_id: t for t, type_id in enumerate(TYPES)}
+    EATS = (2, 0, 1)  # type index -> index of the type it eats
+    MAX_ACTIONS = 20  # 4 single moves, 12 double moves, stay, SPEED and 2 SWITCH
+
+    def allocate(self, maze):
+        self.maze = maze
+        self.eaten = array('I', [0]) * (maze.w * maze.h)
+        self.stamp = 0
+
+    def distance(self, a, b):
+        maze = self.maze
+        return maze.distances[maze.floor_id[a] * len(maze.floor_cells) + maze.floor_id[b]]
+
+    def step_towards(self, a, b):
+        maze = self.maze
+        hop = maze.next_hops[maze.floor_id[a] * len(maze.floor_cells) + maze.floor_id[b]]
+        return a if hop == NO_HOP else maze.neighbours[maze.dirs[hop]][a]
+
+    def step_away(self, a, b):
+        # Neighbour of `a` farthest from `b`, a random one among equals
+        best, best_d, ties = a, self.distance(a, b), 1
+        for c in self.maze.links[a]:
+            d = self.distance(c, b)
+            if d > best_d:
+                best, best_d, ties = c, d, 1
+            elif d == best_d:
+                ties += 1
+                if self.rnd.random() * ties < 1:
+                    best = c
+        return best
+
+    def candidates(self, pac):
+        # Fills `actions`, a MOVE lists the cells the referee walks this turn, none to stay
+        maze, actions = self.maze, self.actions
+        here = maze.index(pac.x, pac.y)
+        actions.clear()
+        for c in maze.links[here]:
+            actions.append(('MOVE', (c,)))
+            if pac.speed_turns_left > 0:
+                # The referee walks a shortest path to the target, only targets two moves away through `c`
+                actions.extend(('MOVE', (c, c2)) for c2 in maze.links[c]
+                               if self.distance(here, c2) == 2 and self.step_towards(here, c2) == c)
+        actions.append(('MOVE', ()))
+        if pac.ability_cooldown == 0:
+            actions.append(('SPEED', None))
+            actions.extend(('SWITCH', t) for t in range(3) if self.TYPES[t] != pac.type_id)
+        return actions
+
+    def evaluate(self, pac, enemies, reserve=0.0):
+        """ Best (action, argument) for `pac` against the Enemy records `enemies`, None when short of time
+
+        Actions are ('MOVE', cell indices walked this turn), ('SPEED', None) and ('SWITCH', type).
+        Enemies of a type outside TYPES are left out.
+        """
+        if pac.type_id not in self.TYPE_INDEX:
+            return None
+        if self.maze is not pac.maze:
+            self.allocate(pac.maze)
+        enemies = [enemy for enemy in enemies if enemy.type_id in self.TYPE_INDEX][:len(self.en_alive)]
+        actions = self.candidates(pac)
+        totals = self.totals
+        for k in range(len(actions)):
+            totals[k] = 0.0
+        rounds = 0
+        while rounds < ROLLOUTS:
+            if self.timer.expired(reserve):
+                break
+            for k, action in enumerate(actions):
+                totals[k] += self.rollout(pac, enemies, action)
+            rounds += 1
+        if rounds < MIN_ROLLOUTS:
+            return None
+
+        best = max(range(len(actions)), key=lambda k: totals[k])  # First best, moves are listed before staying
+        action, arg = actions[best]
+        return action, (self.TYPES[arg] if action == 'SWITCH' else arg)
+
+    def rollout(self, pac, enemies, action):
+        maze, rnd = self.maze, self.rnd
+        expected = maze.pellet_belief.expected
+        eats = self.EATS
+        self.stamp += 1
+        stamp, eaten = self.stamp, self.eaten
+        en_cell, en_prev, en_type = self.en_cell, self.en_prev, self.en_type
+        en_speed, en_cooldown, en_alive, en_steps = self.en_speed, self.en_cooldown, self.en_alive, self.en_steps
+
+        cell = maze.index(pac.x, pac.y)
+        my_type = self.TYPE_INDEX[pac.type_id]
+        speed, cooldown = pac.speed_turns_left, pac.ability_cooldown
+        n = len(enemies)
+        for k, enemy in enumerate(enemies):
+            en_cell[k] = maze.index(enemy.x, enemy.y)
+            en_type[k] = self.TYPE_INDEX[enemy.type_id]
+            en_speed[k] = enemy.speed_turns_left
+            en_cooldown[k] = enemy.ability_cooldown
+            en_alive[k] = 1
+        eaten[cell] = stamp
+
+        value, discount = 0.0, 1.0
+        for turn in range(ROLLOUT_DEPTH):
+            my_steps = 2 if speed > 0 else 1
+            if turn == 0 and action[0] == 'MOVE':
+                my_steps = len(action[1])
+            elif turn == 0:
+                my_steps = 0
+                if action[0] == 'SPEED':
+                    speed, cooldown = SPEED_DURATION + 1, ABILITY_COOLDOWN + 1
+                else:
+                    my_type, cooldown = action[1], ABILITY_COOLDOWN + 1
+
+            # Enemies able to switch next to the pac turn into its eater, the others move
+            for k in range(n):
+                en_steps[k] = 0
+                if not en_alive[k]:
+                    continue
+                if en_cooldown[k] == 0 and eats[en_type[k]] != my_type and self.distance(en_cell[k], cell) <= 2 \
+                        and rnd.random() < 0.5:
+                    en_type[k] = eats.index(my_type)
+                    en_cooldown[k] = ABILITY_COOLDOWN + 1
+                else:
+                    en_steps[k] = 2 if en_speed[k] > 0 else 1
 
-                    # Otherwise let higher id pac pass and you stay
+            for sub in range(2):
+                prev = cell
+                if sub < my_steps:
+                    if turn == 0:
+                        cell = action[1][sub]
                     else:
+                        cell = self.policy(cell, my_type, n)
+                for k in range(n):
+                    en_prev[k] = en_cell[k]
+                    if en_alive[k] and sub < en_steps[k]:
+                        if rnd.random() < 0.25:
+                            links = maze.links[en_cell[k]]
+                            en_cell[k] = links[int(rnd.random() * len(links))] if links else en_cell[k]
+                        elif eats[en_type[k]] == my_type:
+                            en_cell[k] = self.step_towards(en_cell[k], prev)
+                        elif eats[my_type] == en_type[k]:
+                            en_cell[k] = self.step_away(en_cell[k], prev)
+
+                # Shared or swapped cells, the same types block each other
+                for k in range(n):
+                    if not en_alive[k]:
+                        continue
+                    if en_cell[k] == cell or (en_cell[k] == prev and en_prev[k] == cell):
+                        if eats[my_type] == en_type[k]:
+                            en_alive[k] = 0
+                            value += KILL_VALUE * discount
+                        elif eats[en_type[k]] == my_type:
+                            return value - DEATH_COST * discount
+                        else:
+                            cell, en_cell[k] = prev, en_prev[k]
+
+                if eaten[cell] != stamp:
+                    eaten[cell] = stamp
+                    value += expected[cell] * discount
+
+            speed = max(0, speed - 1)
+            cooldown = max(0, cooldown - 1)
+            for k in range(n):
+                en_speed[k] = max(0, en_speed[k] - 1)
+                en_cooldown[k] = max(0, en_cooldown[k] - 1)
+            discount *= 0.9
+        return value
+
+    def policy(self, cell, my_type, n):
+        # The pac after its first action: flee the closest threat, chase the closest prey, or eat
+        eats = self.EATS
+        threat, threat_d, prey, prey_d = None, 4, None, 4
+        for k in range(n):
+            if not self.en_alive[k]:
+                continue
+            d = self.distance(cell, self.en_cell[k])
+            if eats[self.en_type[k]] == my_type and d < threat_d:
+                threat, threat_d = self.en_cell[k], d
+            elif eats[my_type] == self.en_type[k] and d < prey_d:
+                prey, prey_d = self.en_cell[k], d
+        if threat is not None:
+            return self.step_away(cell, threat)
+        if prey is not None:
+            return self.step_towards(cell, prey)
+
+        links = self.maze.links[cell]
+        if not links:
+            return cell
+        expected, eaten, stamp = self.maze.pellet_belief.expected, self.eaten, self.stamp
+        fresh = [c for c in links if eaten[c] != stamp and expected[c] > 0]
+        choices = fresh or links
+        return choices[int(self.rnd.random() * len(choices))]
 
-                        if self.debug: p(f'Staying to let other pac pass')
-
-                        return self.stay()
-
-                # If collision is not happening according to all pac travel queues
-                else:
-
-                    if self.debug: p(f'Not colliding, follow travel queue')
 
-                    return self.follow_travel_queue()
+class Controller:
 
-        # Normal operation, no pacs in vicinity
-        else:
+    strategies = {  # Strategy name -> Controller method returning a travel queue for a pac
+        'greedy': 'simple_greedy_edge',
+        'lookahead': 'lookahead',
+    }
+
+    def __init__(self, timer=None, strategy_name='lookahead'):
+        self.timer = timer if timer is not None else TurnTimer()  # Remaining turn budget for planners
+        self.strategy_name = strategy_name
+        self.assignment = dict()  # pac_id -> Edge the pac is heading for, kept between turns
+        self.auction_pacs = list()  # Sorted ids of the pacs in the last auction, those left without an edge too
+        self.claims = dict()  # edge_id -> pac_id of the pac assigned to it or travelling along it
+        self.reservations = dict()  # ((x, y), step) -> pac_id holding the cell after `step` moves this turn
+        self.opening = dict()  # pac_id -> (super pellet cells in visiting order, uses SPEED first), from turn 0
+        self.opening_turn = 0  # Turn the pacs last played, the opening plan is dropped after OPENING_TURNS
+        self.encounters = EncounterEvaluator(self.timer)
 
-            if self.debug: p(f'Normal operation')
+    @staticmethod
+    def race_turns(moves, speed):
+        # Turns to walk `moves` cells from the start, spending the first turn on SPEED if `speed`
+        if not speed:
+            return moves
+        fast = min(moves, 2 * SPEED_DURATION)
+        return 1 + (fast + 1) // 2 + moves - fast
+
+    def plan_opening(self, my_pacs, maze):
+        """ Shares out the super pellets on turn 0, using its larger budget
+
+        Splits of the super pellets between our pacs are tried, a pac visiting its share in the best order.
+        A super pellet counts when the pac gets there no later than the closest enemy, with both sides using
+        SPEED on turn 0 when it pays off. The split winning the most, then the soonest, is kept and each of
+        its pacs sets off along an opening route it keeps to until its super pellets are gone. The search
+        starts from giving every super pellet to the closest pac winning its race, only offers a super
+        pellet to the pacs that win its race on their own, and stops with the best split so far when the
+        turn budget runs out.
+        """
+        supers = [maze.cells[i] for i in range(maze.w * maze.h) if maze.pellet_dict.super_mask >> i & 1]
+        enemies = [(enemy.x, enemy.y) for enemy in maze.enemies.enemies.values()]
+        pac_ids = sorted(my_pacs)
+        if not supers or not pac_ids:
+            return
 
-            if self.ability_cooldown == 0:
-                if self.debug: p('Normal operation and using speed')
-                return self._speed()
-            else:
+        def fastest(moves):
+            return min(self.race_turns(moves, False), self.race_turns(moves, True))
+
+        enemy_turns = [min((fastest(maze.distance(cell, target)) for cell in enemies), default=UNREACHABLE)
+                       for target in supers]
+
+        visits = dict()
+
+        def visit(pac, targets):
+            # (won, turns, order, speed) of the best order for `pac` to visit the super pellet indices `targets`
+            key = (pac.id, tuple(targets))
+            if key in visits:
+                return visits[key]
+            best = (0, 0, (), False)
+            for order in itertools.permutations(targets):
+                moves = list()
+                cell, total = (pac.x, pac.y), 0
+                for j in order:
+                    total += maze.distance(cell, supers[j])
+                    moves.append(total)
+                    cell = supers[j]
+                if total >= UNREACHABLE:
+                    continue
+                speed = self.race_turns(moves[0], True) < self.race_turns(moves[0], False)
+                won, turns = 0, 0
+                for j, m in zip(order, moves):
+                    arrival = self.race_turns(m, speed)
+                    if arrival <= enemy_turns[j]:
+                        won += 1
+                        turns += arrival
+                if (won, -turns) > (best[0], -best[1]):
+                    best = (won, turns, order, speed)
+            visits[key] = best
+            return best
+
+        def split(owners):
+            # ((won, -turns), plan) of giving super pellet j to the pac owners[j], None leaving it
+            plan, won, turns = dict(), 0, 0
+            for pac_id in pac_ids:
+                targets = [j for j, owner in enumerate(owners) if owner == pac_id]
+                if targets:
+                    pac_won, pac_turns, order, speed = visit(my_pacs[pac_id], targets)
+                    won, turns = won + pac_won, turns + pac_turns
+                    plan[pac_id] = ([supers[j] for j in order], speed)
+            return (won, -turns), plan
+
+        # Pacs winning the race to each super pellet on their own, closest first
+        racers = list()
+        for j in range(len(supers)):
+            winners = [pac_id for pac_id in pac_ids if visit(my_pacs[pac_id], [j])[0]]
+            racers.append(sorted(winners, key=lambda pac_id: maze.distance((my_pacs[pac_id].x, my_pacs[pac_id].y),
+                                                                          supers[j])))
+
+        best, best_plan = split([winners[0] if winners else None for winners in racers])
+        tried = 1
+        for owners in itertools.product(*([None] + winners for winners in racers)):
+            if self.timer.expired():
+                p(f'Opening search out of time after {tried} splits')
+                break
+            tried += 1
+            score, plan = split(owners)
+            if score > best:
+                best, best_plan = score, plan
+
+        self.opening = {pac_id: plan for pac_id, plan in best_plan.items() if plan[0]}
+        for pac_id, (targets, speed) in self.opening.items():
+            pac = my_pacs[pac_id]
+            pac.set_travel_queue(self.opening_route(pac, (pac.x, pac.y)))
+        if any(pac.debug for pac in my_pacs.values()):
+            p(f'Opening: {self.opening}')
+
+    def opening_route(self, pac, cell):
+        """ Route from `cell` through the super pellets left in the pac's opening plan, None when there are none """
+        plan = self.opening.get(pac.id)
+        if plan is None or self.opening_turn > OPENING_TURNS:
+            return None
+        targets = [target for target in plan[0] if pac.maze.pellet_dict[target] > 1]
+        if not targets:
+            del self.opening[pac.id]
+            return None
+        queue = Route(pac.maze.path(cell, targets[0]))
+        for a, b in zip(targets, targets[1:]):
+            queue.extend(Route(pac.maze.path(a, b)), 1)
+        queue = self.cut_revisits(queue)
+        return queue if len(queue) > 1 else None
+
+    def may_speed(self, pac):
+        """ False while the opening plan has the pac race for its super pellets without SPEED """
+        plan = self.opening.get(pac.id)
+        return plan is None or plan[1] or self.opening_turn > OPENING_TURNS
+
+    def assign_edges(self, my_pacs, maze):
+        """ Team level assignment run once per turn before the pacs play
+
+        Gives every pac its own target edge with an auction on pellets per move, the moves being the cached
+        path distance to the nearest end of the edge plus its length. The assignment is kept between turns
+        while the same pacs are alive and their edges still hold pellets. Edges assigned to a pac or on
+        its travel queue are claimed, the strategies do not count the pellets of edges claimed by others.
+        """
+        pac_ids = sorted(my_pacs)
+        if pac_ids != self.auction_pacs or any(e.pellets == 0 for e in self.assignment.values()):
+            self.assignment = self.auction(my_pacs, maze)
+            self.auction_pacs = pac_ids
+            if any(pac.debug for pac in my_pacs.values()):
+                p(f'Edge assignment: {({pac_id: e.id for pac_id, e in self.assignment.items()})}')
+
+        self.claims = {e.id: pac_id for pac_id, e in self.assignment.items()}
+        for pac_id in pac_ids:
+            self.claim_travel_queue(my_pacs[pac_id])
+
+    def claim_travel_queue(self, pac):
+        """ Claims the edges ahead on the travel queue of `pac`, dropping the ones its previous queue claimed """
+        assigned = self.assignment.get(pac.id)
+        for edge_id in [edge_id for edge_id, pac_id in self.claims.items() if pac_id == pac.id]:
+            if assigned is None or edge_id != assigned.id:
+                del self.claims[edge_id]
+
+        maze = pac.maze
+        for cell in pac.travel_queue.cells(pac.travel_queue.cursor):
+            if cell not in maze.nodes and cell in maze.cell_edge:
+                self.claims.setdefault(maze.cell_edge[cell][0], pac.id)
+
+    def resolve_moves(self, my_pacs, commands):
+        """ Settles friendly collisions in one deterministic pass over a space-time reservation table
+
+        Every pac holds (cell, step) for where it stands after each of the turn's moves, step 0 being its
+        current cell and step 2 the second move under SPEED, pacs that stay hold their cell throughout.
+        Higher ids get right of way, but a pac entering a teammate's cell is settled after that teammate
+        so it only follows one that actually leaves. A pac that would share a cell or swap places with a
+        settled teammate stops short, staying if it cannot take its first step. Returns pac_id -> command.
+        """
+        self.reservations = {((pac.x, pac.y), 0): pac_id for pac_id, pac in my_pacs.items()}
+        occupants = {(pac.x, pac.y): pac_id for pac_id, pac in my_pacs.items()}
+        settled = dict()  # pac_id -> False while being settled, True once its cells are reserved
+
+        def settle(pac_id):
+            pac = my_pacs[pac_id]
+            settled[pac_id] = False
+            for cell in pac.planned_steps:
+                other = occupants.get(cell)
+                if other is not None and other != pac_id and other not in settled:
+                    settle(other)
+
+            previous = (pac.x, pac.y)
+            steps = list()
+            for step, cell in enumerate(pac.planned_steps, 1):
+                other = occupants.get(cell)
+                if other is not None and other != pac_id and not settled[other]:
+                    break  # Teammates entering each other's cells in a cycle
+                owner = self.reservations.get((cell, step))
+                if owner is not None and owner != pac_id:
+                    break
+                owner = self.reservations.get((cell, step - 1))
+                if owner is not None and owner != pac_id and self.reservations.get((previous, step)) == owner:
+                    break  # Swap
+                steps.append(cell)
+                previous = cell
+
+            cell = (pac.x, pac.y)
+            for step in (1, 2):
+                if step <= len(steps):
+                    cell = steps[step - 1]
+                self.reservations[(cell, step)] = pac_id
+            settled[pac_id] = True
+
+            if len(steps) < len(pac.planned_steps):
+                if pac.debug: p(f'Pac({pac_id}) stops short of {pac.planned_steps} at {steps} for a teammate')
+                commands[pac_id] = pac._move(*steps[-1]) if steps else pac.stay()
+
+        for pac_id in sorted(my_pacs, reverse=True):
+            if pac_id not in settled:
+                settle(pac_id)
+        return commands
 
-                if self.debug: p(f'Normal operation, following travel queue')
+    @staticmethod
+    def auction(my_pacs, maze):
+        """ pac_id -> Edge maximising the team's pellets per move, pacs without a worthwhile edge get none """
+        edges = [e for e in maze.edges.values() if e.pellets > 0 and e.expected > 0]
+        values = dict()  # pac_id -> value of every edge in `edges`
+        for pac_id, pac in my_pacs.items():
+            cell = (pac.x, pac.y)
+            row = list()
+            for e in edges:
+                moves = min(maze.distance(cell, (e.node1.x, e.node1.y)), maze.distance(cell, (e.node2.x, e.node2.y)))
+                row.append(0.0 if moves == UNREACHABLE else e.expected / (moves + e.length))
+            values[pac_id] = row
+
+        prices = [0.0] * len(edges)
+        owners = [None] * len(edges)
+        assignment = dict()
+        bidders = sorted(my_pacs, reverse=True)
+        while bidders:
+            pac_id = bidders.pop()
+            # Best and second best edge net of prices, staying unassigned is worth 0
+            best, second, best_j = 0.0, 0.0, None
+            for j, value in enumerate(values[pac_id]):
+                net = value - prices[j]
+                if net > best:
+                    best, second, best_j = net, best, j
+                elif net > second:
+                    second = net
+            if best_j is None:
+                continue
 
-                return self.follow_travel_queue()
+            # Outbid the current owner, who bids again
+            prices[best_j] += best - second + AUCTION_EPSILON
+            if owners[best_j] is not None:
+                del assignment[owners[best_j]]
+                bidders.append(owners[best_j])
+            owners[best_j] = pac_id
+            assignment[pac_id] = edges[best_j]
 
+        return assignment
 
-class Controller:
+    def edge_pellets(self, pac, e):
+        """ Expected pellets on `e` worth heading for, none if another pac claimed the edge or an enemy eating
+        the pac may be on it
+        """
+        if self.claims.get(e.id, pac.id) != pac.id or \
+                e.mask & pac.maze.enemies.danger_masks[pac.type_id][DANGER_EDGE_TURNS]:
+            return 0
+        return e.expected
+
+    def route_to_assignment(self, pac, cell):
+        """ Shortest route from `cell` to the nearest end of the pac's assigned edge, then along it """
+        e = self.assignment.get(pac.id)
+        if e is None:
+            return None
+        maze = pac.maze
+        start = min((e.node1, e.node2), key=lambda node: maze.distance(cell, (node.x, node.y)))
+
+        queue = maze.route_to_node(cell, start)
+        if queue is None:
+            queue = Route(maze.path(cell, (start.x, start.y)))  # A loop without junctions
+        if len(queue) > LOOKAHEAD_MAX_MOVES:
+            queue.truncate(LOOKAHEAD_MAX_MOVES + 1)
+        elif queue[-1] == (start.x, start.y):
+            queue.append_edge(e, start, 1)
+        queue = self.cut_revisits(queue)
+        return queue if len(queue) > 1 else None
 
-    def __init__(self):
-        pass
+    @staticmethod
+    def cut_revisits(queue):
+        # Cut a route before it revisits a cell, pacs find themselves on their queue by cell
+        seen = set()
+        for i, cell in enumerate(queue):
+            if cell in seen:
+                queue.truncate(i)
+                break
+            seen.add(cell)
+        return queue
 
-    def strategy(self, pac):
-        """ Current strategy """
-        return self.simple_greedy_edge(pac)
+    def strategy(self, pac, cell=None):
+        """ Current strategy, planning a travel queue for `pac` as if it stood on `cell`
 
-    def simple_greedy_edge(self, pac):
+        `cell` defaults to the pac's own cell, planning from the end of its travel queue lets a pac under
+        SPEED chain the next queue. Strategies read the pac but never change it.
+        """
+        if cell is None:
+            cell = (pac.x, pac.y)
+        opening = self.opening_route(pac, cell)
+        if opening is not None:
+            return opening
+        return getattr(self, self.strategies[self.strategy_name])(pac, cell, pac.travel_queue)
+
+    def lookahead(self, pac, cell, queue):
+        """ Depth limited search over the Node / Edge graph for the route with the most pellets per move
+
+        Routes run from the pac's node (or from its cell towards either end of its edge) through joint nodes
+        and stop at terminal nodes. Sub routes are memoised per (node, depth left, edge arrived by) and the
+        depth is deepened while the turn budget allows. Edges claimed by other pacs count no pellets. Heads
+        for the assigned edge when no route holds pellets, or falls back to `simple_greedy_edge`.
+        """
+        maze = pac.maze
+        node = maze.nodes.get(cell)
+
+        # Mid edge with a travel queue, keep following it
+        if node is None and queue and queue[-1] != cell:
+            return queue
+
+        def better(a, b):
+            # Compare (pellets, moves) by pellets per move, then by pellets
+            return b is None or a[0] * b[1] > b[0] * a[1] or (a[0] * b[1] == b[0] * a[1] and a[0] > b[0])
+
+        def gain(e, node):
+            # Pellets along `e` leaving `node`, the node cell counts for the edge arriving there
+            pellets = self.edge_pellets(pac, e)
+            return max(0.0, pellets - maze.pellet_belief[(node.x, node.y)]) if pellets else pellets
+
+        def chain(pellets, moves, e, sub):
+            # Continue with the sub route `sub`, an edge it passes again after `e` holds nothing the second time
+            repeated = sum(gain(f, from_node) for f, from_node in sub[2] if f is e)
+            return pellets + sub[0] - repeated, moves + sub[1]
+
+        def search(depth):
+            memo = dict()
+
+            def best(node, depth, prev):
+                # Best (pellets, moves, [(edge, from node)]) continuation from `node`, never going back along `prev`
+                key = (node.id, depth, prev.id if prev is not None else -1)
+                if key in memo:
+                    return memo[key]
+
+                result = None
+                for e in node.edges:
+                    if e is None or e is prev:
+                        continue
+                    candidate = (gain(e, node), e.length - 1, [(e, node)])
+                    other = e.other_node(node)
+                    if depth > 1 and other.type == 'joint':
+                        sub = best(other, depth - 1, e)
+                        if sub is not None and candidate[1] + sub[1] <= LOOKAHEAD_MAX_MOVES:
+                            extended = (*chain(candidate[0], candidate[1], e, sub), candidate[2] + sub[2])
+                            if better(extended, candidate):
+                                candidate = extended
+                    if better(candidate, result):
+                        result = candidate
+
+                memo[key] = result
+                return result
+
+            if node is not None:
+                route = best(node, depth, None)
+                if route is None:
+                    return None
+                queue = Route.along(route[2][0][0], node)
+                pellets = route[0]
+                edges = route[2][1:]
+            else:
+                # Enter the graph from the middle of an edge, towards either of its ends
+                e, index = maze.get_edge(*cell)
+                if e is None:
+                    return None  # A loop without junctions
+                route, start_view = None, None
+                for view, end in (((index, e.length - index, 1), e.node2), ((index, index + 1, -1), e.node1)):
+                    start, count, step = view
+                    moves = range(start + step, start + count * step, step)
+                    candidate = (sum(maze.pellet_belief[e.path[i]] for i in moves), count - 1, [])
+                    sub = best(end, depth - 1, e) if depth > 1 and end.type == 'joint' else None
+                    if sub is not None and candidate[1] + sub[1] <= LOOKAHEAD_MAX_MOVES:
+                        extended = (*chain(candidate[0], candidate[1], e, sub), sub[2])
+                        if better(extended, candidate):
+                            candidate = extended
+                    if better(candidate, route):
+                        route, start_view = candidate, view
+                queue = Route()
+                queue.append(e.path, *start_view)
+                pellets = route[0]
+                edges = route[2]
+
+            if pellets == 0:
+                return None
+            for e, from_node in edges:
+                queue.append_edge(e, from_node, 1)
+            return self.cut_revisits(queue)
+
+        route = self.timer.deepen(search, LOOKAHEAD_DEPTH)
+        if not route or len(route) < 2:
+            route = self.route_to_assignment(pac, cell)
+            if route is None:
+                return self.simple_greedy_edge(pac, cell, queue)
+            if pac.debug: p(f'Heading for assigned edge: {route}')
+            return route
+        if pac.debug: p(f'Lookahead route: {route}')
+        return route
+
+    def simple_greedy_edge(self, pac, cell, queue):
         # If pac at a joint node, assign a travel queue for the best edge visible
-        joint_nodes = [cell for cell, node in pac.maze.nodes.items() if node.type == 'joint']
-
         # If at joint node, choose the edge which seems the best based on pellet count
-        if (pac.x, pac.y) in joint_nodes:
+        if cell in pac.maze.joint_nodes:
 
             if pac.debug: p('Pac at joint node')
 
-            node = pac.maze.nodes[(pac.x, pac.y)]
-            connected_edges = [node[d] for d in pac.maze.dirs if node[d] is not None]
-
-            edge_pellet_dict = dict()
-            for edge in connected_edges:
-                edge_pellet_dict[edge.id] = 0
+            node = pac.maze.nodes[cell]
+            connected_edges = [e for e in node.edges if e is not None]
 
-                for cell in edge.path:
-                    edge_pellet_dict[edge.id] += pac.maze.pellet_dict[cell]
+            edge_pellet_dict = {edge.id: self.edge_pellets(pac, edge) for edge in connected_edges}
 
-            best_edge_id = max(edge_pellet_dict, key=lambda x: edge_pellet_dict[x])
+            # Ties, mostly between empty edges, go to the edge leading on to more pellets
+            scores = pac.maze.region_scores
+            best_edge_id = max(edge_pellet_dict,
+                               key=lambda x: (edge_pellet_dict[x], scores.region(pac.maze.edges[x])))
             best_edge = pac.maze.edges[best_edge_id]
+            other = best_edge.other_node(node)
 
-            if best_edge.node1 == node:
+            if pac.debug: p(f'Best path ({node.x}, {node.y}) -> ({other.x}, {other.y})')
 
-                if pac.debug: p(f'Best path ({best_edge.node1.x}, {best_edge.node1.y}) -> ({best_edge.node2.x}, {best_edge.node2.y})')
-
-                return best_edge.path
-            else:
-
-                if pac.debug: p(
-                    f'Best path ({best_edge.node2.x}, {best_edge.node2.y}) -> ({best_edge.node1.x}, {best_edge.node1.y})')
-
-                return list(reversed(best_edge.path))
+            return Route.along(best_edge, node)
 
         # else if in terminal nodes, reverse current travel queue
-        elif (pac.x, pac.y) in pac.maze.nodes:
+        elif cell in pac.maze.nodes:
 
             if pac.debug: p('Pac at terminal node')
 
             # If there exists a travel queue, reverse
-            if pac.travel_queue:
+            if queue:
 
                 if pac.debug: p('Reversing travel queue')
 
-                return list(reversed(pac.travel_queue))
+                return queue.reversed()
 
             # Else move to closest joint node
             else:
 
                 if pac.debug: p('moving to closest joint node since I am at terminal node')
 
-                return self.move_to_closest_joint_node(pac)
+                return self.move_to_closest_joint_node(pac, cell)
 
         # If not on any node
         else:
 
             if pac.debug: p('Not on any node')
 
-            if pac.travel_queue:
+            if queue and queue[-1] != cell:
                 if pac.debug: p('Pac has travel queue, moving on it')
-                return pac.travel_queue
+                return queue
             else:
                 if pac.debug: p('Pac not on node and no travel queue; moving to closest node')
-                return self.move_to_closest_joint_node(pac)
+                return self.move_to_closest_joint_node(pac, cell)
 
     @staticmethod
-    def move_to_closest_joint_node(pac):
-        pac_loc = (pac.x, pac.y)
-
-        # Check which edge the `pac` is on
-        for _, e in maze.edges.items():
-            if pac_loc in e.path:
-                # Move to the edge side with higher points
-                index_on_edge = e.path.index(pac_loc)
-                cells_to_right = e.path[index_on_edge + 1:]  ### Remove +1 if index errors
-                cells_to_left = e.path[:index_on_edge]
-
-                pellets_to_right = 0
-                pellets_to_left = 0
-
-                for cell in cells_to_right:
-                    pellets_to_right += pac.maze.pellet_dict[cell]
-                for cell in cells_to_left:
-                    pellets_to_left += pac.maze.pellet_dict[cell]
-
-                if pellets_to_right > pellets_to_left:
-                    travel_queue = e.path
-                else:
-                    travel_queue = list(reversed(e.path))
-
-                #
-                # if e.node1.type == 'terminal':
-                #     # If one node is terminal, move towards other (which will be joint)
-                #     travel_queue = e.path
-                #
-                # elif e.node2.type == 'terminal':
-                #     # If one node is terminal, move towards other (which will be joint)
-                #     travel_queue = list(reversed(e.path))
-                #
-                # elif e.path.index(pac_loc) < math.floor(len(e.path) / 2.0):
-                #     # Closest node is on the half side of the edge the pac is in
-                #     travel_queue = list(reversed(e.path))
-                #
-                # else:
-                #     # Closest node is on the half side of the edge the pac is in
-                #     travel_queue = e.path
-                break
+    def move_to_closest_joint_node(pac, cell):
+        # Check which edge `cell` is on
+        e, index_on_edge = pac.maze.get_edge(*cell)
+
+        if e is None:
+            # A loop without junctions, walk once around it
+            queue = [cell]
+            while True:
+                steps = [c for c in (pac.maze.get_coord(*queue[-1], dir)
+                                     for dir in pac.maze.get_available_dirs(*queue[-1])) if c not in queue]
+                if not steps:
+                    return Route(queue)
+                queue.append(steps[0])
+
+        # Move to the edge side with higher points
+        pellets_to_left, pellets_to_right = pac.maze.region_scores.split(e, index_on_edge)
+
+        if pellets_to_right > pellets_to_left:
+            travel_queue = Route.along(e, e.node1)
+        elif pellets_to_left > pellets_to_right:
+            travel_queue = Route.along(e, e.node2)
+        else:
+            # Nothing to eat either way, head for the closest joint node over the Node / Edge graph
+            maze = pac.maze
+            joints = [maze.nodes[joint] for joint in maze.joint_nodes]
+            closest = min(joints, key=lambda node: maze.node_distance(cell, node)[0], default=None)
+            travel_queue = maze.route_to_node(cell, closest) if closest is not None else None
+            if travel_queue is None or len(travel_queue) < 2:
+                travel_queue = Route.along(e, e.node2)
 
         return travel_queue
 
 
-def update(turn_id, my_pacs, maze, con):
-
-    def pac_update(visible_pac_count, my_pacs, maze, con):
-        en_pacs = dict()
+def update(turn_id, turn, my_pacs, maze, con):
 
+    def pac_update(visible_pacs, my_pacs, maze, con):
         alive = {id: False for id in my_pacs}
 
-        for i in range(visible_pac_count):
-            pac_id, mine, x, y, type_id, speed_turns_left, ability_cooldown = input().split()
-            pac_id, mine, x, y, speed_turns_left, ability_cooldown = \
-                map(int, (pac_id, mine, x, y, speed_turns_left, ability_cooldown))
-
-            mine = mine == 1
-            if mine:
+        for pac_id, mine, x, y, type_id, speed_turns_left, ability_cooldown in visible_pacs:
+            if mine and type_id != 'DEAD':  # The referee keeps sending dead pacs
                 alive[pac_id] = True
                 if pac_id not in my_pacs:
                     # My pac
@@ -903,47 +2501,82 @@ def update(turn_id, my_pacs, maze, con):
                     this_pac.speed_turns_left = speed_turns_left
                     this_pac.ability_cooldown = ability_cooldown
                     this_pac.maze = maze
+                    this_pac.advance_cursor()
                     my_pacs[pac_id] = this_pac
 
-            else:
-                # Enemy pac
-                en_pacs[pac_id] = Pac(pac_id, x, y, type_id, speed_turns_left, ability_cooldown, maze, con)
-
         # If did not receive update for a pac, delete it from my_pacs
         dead_pacs = [pac_id for pac_id, value in alive.items() if value == False]
 
         for pac_id in dead_pacs:
             del my_pacs[pac_id]
 
-        # Store all pac data inside each of my pac (Woah! A pac will have itself in an attribute)
-        for _, my_pac in my_pacs.items():
-            my_pac.my_pacs = my_pacs
-            my_pac.en_pacs = en_pacs
+        return my_pacs
 
-        return my_pacs, en_pacs
+    my_pacs = pac_update(turn.pacs, my_pacs, maze, con)  # all your pacs
 
-    visible_pac_count = int(input())
-    my_pacs, en_pacs = pac_update(visible_pac_count, my_pacs, maze, con)  # all your pacs and enemy pacs in sight
+    maze.update_pellet_map(turn_id, turn.pellets, my_pacs)
+    maze.enemies.update(turn_id, turn.pacs, my_pacs)  # Enemy records, the ones in sight are in maze.enemies.visible
+    maze.update_pellet_belief(turn_id, turn.opponent_score, turn.pellets, my_pacs)
+    maze.region_scores.refresh(maze.pellet_belief.expected)
 
-    visible_pellet_count = int(input())
-    visible_pellet_dict = dict()
+    return my_pacs, maze.enemies.visible
 
-    for i in range(visible_pellet_count):
-        x, y, value = [int(j) for j in input().split()]
-        visible_pellet_dict[(x, y)] = value
 
-    maze.update_pellet_map(turn_id, visible_pellet_dict, my_pacs)
+def init_maze(w, h, rows):
+    """ Builds the maze from the map rows and runs the startup precomputation """
+    maze = Maze(w, h, rows)
+    maze.construct_nodes()
+    maze.construct_edges()
+    maze.construct_topology()
+    maze.construct_distances()
+    maze.construct_visibility()
+    return maze
+
+
+def take_turn(turn_id, turn, my_pacs, maze, con, c):
+    """ Updates the game state from the parsed turn, lets every pac decide and publishes the commands """
+
+    # Update all game stats
+    my_pacs, en_pacs = update(turn_id, turn, my_pacs, maze, con)
+
+    # Race for the super pellets on the first turn, then share out the edges between pacs before they plan
+    con.opening_turn = turn_id
+    if turn_id == 0:
+        con.plan_opening(my_pacs, maze)
+    con.assign_edges(my_pacs, maze)
+
+    # Let Pacs decide next move
+    commands = dict()
+    for pac_id, pac in my_pacs.items():
+        if pac_id == 2:
+            pac.debug = True
+        try:
+            commands[pac_id] = pac.play()
+        except Exception as e:
+            p(f'ERROR: Pac {pac_id}')
+            raise
+
+    # Settle friendly collisions before publishing
+    for command in con.resolve_moves(my_pacs, commands).values():
+        c.add_command(command)
+
+    p(c.command_queue)
+    # Publish all commands
+    c.publish()
 
     return my_pacs, en_pacs
 
 
 if __name__ == '__main__':
-    maze = Maze()
-    maze.construct_nodes()
-    maze.construct_edges()
+    # The map comes with the first turn, so its precomputation counts against the first turn budget
+    timer = TurnTimer()
+    timer.start(0)
+
+    reader = InputReader()  # Buffered referee input
+    maze = init_maze(*reader.read_map())
 
     c = Commander()  # For tracking and publishing final commands to stdout
-    con = Controller()  # Game strategy maker
+    con = Controller(timer)  # Game strategy maker
 
     my_pacs = dict()
     en_pacs = dict()
@@ -951,28 +2584,14 @@ if __name__ == '__main__':
     # game loop
     turn_id = 0
     while True:
-        # Update score
-        my_score, opponent_score = [int(i) for i in input().split()]
-
-        # Update all game stats
-        my_pacs, en_pacs = update(turn_id, my_pacs, maze, con)
+        # Read the whole turn, the timer starts with its first line
+        turn = reader.read_turn(turn_id, timer)
 
-        # Let Pacs decide next move
-        for pac_id, pac in my_pacs.items():
-            if pac_id == 2:
-                pac.debug = True
-            try:
-                c.add_command(pac.play())
-            except Exception as e:
-                p(f'ERROR: Pac {pac_id}')
-                raise
-
-        p(c.command_queue)
-        # Publish all commands
-        c.publish()
+        my_pacs, en_pacs = take_turn(turn_id, turn, my_pacs, maze, con, c)
+        timer.stop()
+        timer.log()
 
         # Increment turn counter
         turn_id += 1
 
-    # TODO: Fix friendly collisions from pacs 2 distance away
-    # TODO: Fix pac stuck in terminal edge when in speed mode
\ No newline at end of file
+    # TODO: Fix pac stuck in terminal edge when in speed mode
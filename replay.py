@@ -0,0 +1,295 @@
+""" Offline replay harness and turn latency benchmark for player.py
+
+Feeds recorded or synthetic referee input through the bot's Maze / update / Pac.play pipeline
+and reports startup time, per-turn latency percentiles and peak memory.
+
+Usage:
+    python replay.py                                          # synthetic games on several sizes and pac counts
+    python replay.py --sizes 35x17 --pacs 5 --games 3
+    python replay.py --sizes 35x17 --pacs 3 --record game     # also dump each game's input to game-*.txt
+    python replay.py game-35x17-3-0.txt                       # replay recorded referee input
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tracemalloc
+
+from mapgen import generate_map, map_input
+import player
+
+
+PAC_TYPES = ['ROCK', 'PAPER', 'SCISSORS']
+EATEN_BY = {'ROCK': 'PAPER', 'PAPER': 'SCISSORS', 'SCISSORS': 'ROCK'}  # type -> type that eats it
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))]
+
+
+class RecordedGame:
+    """ Referee input captured from a real game, the bot output does not influence it """
+
+    def __init__(self, lines, name='recorded'):
+        self.map_lines, self.turns = self.split_turns(lines)
+        self.name = name
+
+    @staticmethod
+    def split_turns(lines):
+        lines = [line.rstrip('\n') for line in lines]
+        h = int(lines[0].split()[1])
+        map_lines = lines[:h + 1]
+
+        turns = list()
+        i = h + 1
+        while i < len(lines) and lines[i].strip():
+            start = i
+            i += 1  # Score line
+            i += int(lines[i]) + 1  # Pac count and pac lines
+            i += int(lines[i]) + 1  # Pellet count and pellet lines
+            turns.append(lines[start:i])
+        return map_lines, turns
+
+    def next_turn(self, turn_id):
+        if turn_id < len(self.turns):
+            return self.turns[turn_id]
+        return None
+
+    def respond(self, output):
+        pass
+
+
+class SyntheticReferee:
+    """ Minimal stand-in for the referee on a generated map
+
+    Our pacs follow their MOVE commands along shortest paths (two steps under SPEED), enemies wander
+    randomly, SPEED and SWITCH respect cooldowns and pellets are scored. Combat is reduced to a pac
+    ending a move on the cell of an enemy eating it, it dies and is sent with type DEAD from then on
+    like the real referee does. Input is filtered by line of sight like the real fog of war.
+    """
+
+    def __init__(self, w, h, pac_count, seed, turns=200):
+        self.name = f'{w}x{h}-{pac_count}-{seed}'
+        self.rnd = random.Random(seed)
+        self.rows = generate_map(w, h, seed)
+        self.map_lines = map_input(self.rows)
+        self.maze = player.init_maze(w, h, self.rows)
+        self.turns = turns
+        self.scores = [0, 0]
+
+        # Our pacs start on the left half, enemies mirror them on the right half
+        floor = [self.maze.cells[i] for i in self.maze.floor_cells]
+        starts = self.rnd.sample([(x, y) for x, y in floor if x < w // 2], pac_count)
+        self.pacs = dict()  # (mine, pac_id) -> [x, y, type, speed_turns_left, ability_cooldown]
+        for pac_id, (x, y) in enumerate(starts):
+            type_id = self.rnd.choice(PAC_TYPES)
+            self.pacs[(1, pac_id)] = [x, y, type_id, 0, 0]
+            self.pacs[(0, pac_id)] = [w - 1 - x, y, type_id, 0, 0]
+
+        occupied = {(pac[0], pac[1]) for pac in self.pacs.values()}
+        self.pellets = {cell: 1 for cell in floor if cell not in occupied}
+        for x, y in self.rnd.sample([cell for cell in self.pellets if cell[0] < w // 2], 2):
+            self.pellets[(x, y)] = player.SUPER_PELLET_VALUE
+            self.pellets[(w - 1 - x, y)] = player.SUPER_PELLET_VALUE
+
+    def next_turn(self, turn_id):
+        if turn_id >= self.turns or not any(self.pellets.values()):
+            return None
+
+        maze = self.maze
+        visible_mask = maze.get_visible_mask([(pac[0], pac[1]) for key, pac in self.pacs.items() if key[0]])
+
+        pac_lines = list()
+        for (mine, pac_id), (x, y, type_id, speed_turns_left, ability_cooldown) in self.pacs.items():
+            if mine or type_id == 'DEAD' or visible_mask >> maze.index(x, y) & 1:
+                pac_lines.append(f'{pac_id} {mine} {x} {y} {type_id} {speed_turns_left} {ability_cooldown}')
+
+        pellet_lines = [f'{x} {y} {value}' for (x, y), value in self.pellets.items()
+                        if value and (value > 1 or visible_mask >> maze.index(x, y) & 1)]
+
+        return [f'{self.scores[0]} {self.scores[1]}', str(len(pac_lines))] + pac_lines + \
+               [str(len(pellet_lines))] + pellet_lines
+
+    def respond(self, output):
+        targets = dict()
+        for command in output.split('|'):
+            words = command.split()
+            if not words:
+                continue
+            pac = self.pacs.get((1, int(words[1])))
+            if pac is None or pac[2] == 'DEAD':
+                continue
+            if words[0] == 'MOVE':
+                targets[int(words[1])] = (int(words[2]), int(words[3]))
+            elif words[0] == 'SPEED' and pac[4] == 0:
+                pac[3], pac[4] = 5, 10
+            elif words[0] == 'SWITCH' and pac[4] == 0:
+                pac[2], pac[4] = words[2], 10
+
+        for (mine, pac_id), pac in self.pacs.items():
+            if pac[2] == 'DEAD':
+                continue
+            for _ in range(2 if pac[3] > 0 else 1):
+                if mine:
+                    target = targets.get(pac_id)
+                    if target is None or not self.maze.is_floor(*target):
+                        break
+                    pac[0], pac[1] = self.maze.next_cell((pac[0], pac[1]), target)
+                else:
+                    pac[0], pac[1] = self.rnd.choice([self.maze.get_coord(pac[0], pac[1], dir)
+                                                      for dir in self.maze.get_available_dirs(pac[0], pac[1])])
+                self.scores[1 - mine] += self.pellets.get((pac[0], pac[1]), 0)
+                self.pellets[(pac[0], pac[1])] = 0
+            pac[3] = max(0, pac[3] - 1)
+            pac[4] = max(0, pac[4] - 1)
+
+        for (mine, _), pac in self.pacs.items():
+            if any(other_mine != mine and other[:2] == pac[:2] and other[2] == EATEN_BY.get(pac[2])
+                   for (other_mine, _), other in self.pacs.items()):
+                pac[2:] = ['DEAD', 0, 0]
+
+
+def run_game(game, measure_memory=False):
+    """ Plays one game through the bot pipeline
+
+    Returns (startup seconds, per-turn seconds, peak bytes, exception raised by the bot or None)
+    """
+    stdout = sys.stdout
+    bot_in, bot_out = io.StringIO(), io.StringIO()
+    reader = player.InputReader(bot_in)
+
+    def feed(lines):
+        position = bot_in.tell()
+        bot_in.seek(0, io.SEEK_END)
+        bot_in.write('\n'.join(lines) + '\n')
+        bot_in.seek(position)
+
+    if measure_memory:
+        tracemalloc.start()
+
+    sys.stdout = bot_out
+    try:
+        timer = player.TurnTimer()
+        timer.start(0)
+        feed(game.map_lines)
+        maze = player.init_maze(*reader.read_map())
+        startup = timer.elapsed()
+
+        c = player.Commander()
+        con = player.Controller(timer)
+        my_pacs = dict()
+
+        error = None
+        turn_id = 0
+        while True:
+            lines = game.next_turn(turn_id)
+            if lines is None:
+                break
+            feed(lines)
+            turn = reader.read_turn(turn_id, timer)
+            try:
+                my_pacs, _ = player.take_turn(turn_id, turn, my_pacs, maze, con, c)
+            except Exception as e:
+                # A crash loses the game in the arena, stop here and report it
+                error = e
+                break
+            timer.stop()
+
+            output = bot_out.getvalue()
+            bot_out.seek(0)
+            bot_out.truncate()
+            game.respond(output)
+            turn_id += 1
+    finally:
+        sys.stdout = stdout
+
+    peak = 0
+    if measure_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return startup, timer.history, peak, error
+
+
+def report(name, games, startups, first_turns, turns, peaks, crashes):
+    ms = [1000 * x for x in (sum(startups) / len(startups), max(first_turns), percentile(turns, 50),
+                             percentile(turns, 90), percentile(turns, 99), max(turns))]
+    over_budget = sum(1 for x in turns if x > player.TURN_BUDGET)
+    peak = f' | peak {max(peaks) / 1024:.0f}KB' if peaks else ''
+    print('{:<16} games {:3d} | startup {:6.1f}ms | first turn {:6.1f}ms | turn p50 {:5.2f}ms p90 {:5.2f}ms '
+          'p99 {:5.2f}ms max {:6.2f}ms | over budget {} | crashed {}{}'.format(name, games, *ms, over_budget,
+                                                                                len(crashes), peak))
+    for game_name, turn_id, error in crashes:
+        print(f'    {game_name} crashed on turn {turn_id}: {type(error).__name__}: {error}')
+
+
+def benchmark(name, make_games, measure_memory, record):
+    startups, first_turns, turns, peaks, crashes = list(), list(), list(), list(), list()
+    games = 0
+    for game in make_games():
+        if record:
+            # Replaying a synthetic game without the bot's responses only gives its first turn, so record it live
+            recorded = list(game.map_lines)
+            next_turn = game.next_turn
+
+            def recording_next_turn(turn_id, next_turn=next_turn, recorded=recorded):
+                lines = next_turn(turn_id)
+                if lines is not None:
+                    recorded.extend(lines)
+                return lines
+            game.next_turn = recording_next_turn
+
+        startup, history, _, error = run_game(game)
+        if error is not None:
+            crashes.append((game.name, len(history), error))
+        if not history:
+            continue
+        games += 1
+        startups.append(startup)
+        first_turns.append(history[0])
+        turns.extend(history[1:] or history)
+
+        if record:
+            with open(f'{record}-{game.name}.txt', 'w') as f:
+                f.write('\n'.join(recorded) + '\n')
+
+    if measure_memory:
+        for game in make_games():
+            peaks.append(run_game(game, measure_memory=True)[2])
+
+    if games:
+        report(name, games, startups, first_turns, turns, peaks, crashes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('recordings', nargs='*', help='referee input files to replay instead of synthetic games')
+    parser.add_argument('--sizes', nargs='+', default=['28x10', '31x13', '35x17'], help='synthetic map sizes WxH')
+    parser.add_argument('--pacs', nargs='+', type=int, default=[1, 3, 5], help='synthetic pacs per side')
+    parser.add_argument('--games', type=int, default=2, help='synthetic games per size and pac count')
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record', help='prefix for dumping the input of every synthetic game')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--stderr', action='store_true', help='keep the bot debug output')
+    args = parser.parse_args()
+
+    if not args.stderr:
+        sys.stderr = open(os.devnull, 'w')
+
+    if args.recordings:
+        for path in args.recordings:
+            with open(path) as f:
+                lines = f.readlines()
+            benchmark(os.path.basename(path), lambda: [RecordedGame(lines, os.path.basename(path))],
+                      not args.no_memory, None)
+    else:
+        for size in args.sizes:
+            w, h = [int(x) for x in size.split('x')]
+            for pac_count in args.pacs:
+                seeds = range(args.seed, args.seed + args.games)
+                benchmark(f'{w}x{h} {pac_count} pacs',
+                          lambda: [SyntheticReferee(w, h, pac_count, seed, args.turns) for seed in seeds],
+                          not args.no_memory, args.record)
@@ -0,0 +1,352 @@
+""" Headless in-process simulator of the Spring Challenge 2020 rules
+
+Both players are in-process bots fed TurnInput tuples filtered by fog of war, their Commander output is
+parsed back into actions. Rules implemented:
+    - MOVE follows a shortest path towards the target, one step or two steps while SPEED is active
+    - Pacs of the same player or of the same type block each other when they would share a cell or swap
+    - ROCK beats SCISSORS, SCISSORS beats PAPER, PAPER beats ROCK on a shared or crossed cell
+    - SPEED (5 turns) and SWITCH replace the pac's move and put the ability on a 10 turn cooldown
+    - Pellets are worth 1, super pellets 10, pacs see along straight lines and super pellets are always visible
+    - Dead pacs of both players stay in the input with type DEAD
+    - The game ends after 200 turns, when no pellets are left, when a player cannot catch up any more or when
+      a player has no pacs left (the remaining pellets go to the opponent)
+
+Usage: python simulator.py [--games 10] [--seed 0]
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+from mapgen import generate_map
+import player
+
+
+PAC_TYPES = ('ROCK', 'PAPER', 'SCISSORS')
+BEATS = {'ROCK': 'SCISSORS', 'PAPER': 'ROCK', 'SCISSORS': 'PAPER'}  # type -> type it eats
+SPEED_DURATION = 5
+ABILITY_COOLDOWN = 10
+MAX_TURNS = 200
+SUPER_PELLET_PAIRS = 2
+
+GameResult = namedtuple('GameResult', ['seed', 'width', 'height', 'pac_count', 'scores', 'winner', 'turns',
+                                       'crashed', 'error', 'turn_times'])
+# winner: 0, 1 or -1 for a draw, crashed: index of the player whose bot raised or None, error: its exception,
+# turn_times: per player list of seconds spent answering each turn
+
+
+class SimPac:
+    __slots__ = ('owner', 'id', 'cell', 'type_id', 'speed_turns_left', 'ability_cooldown', 'alive')
+
+    def __init__(self, owner, id, cell, type_id):
+        self.owner = owner
+        self.id = id
+        self.cell = cell
+        self.type_id = type_id
+        self.speed_turns_left = 0
+        self.ability_cooldown = 0
+        self.alive = True
+
+
+class PlayerBot:
+    """ player.py playing in process
+
+    `module` is the loaded bot source (player.py or a copy of it) and `strategy_name` picks one of its
+    Controller.strategies instead of the default one, so variants can be compared
+    """
+
+    def __init__(self, module=player, strategy_name=None):
+        self.module = module
+        self.strategy_name = strategy_name
+
+    def start(self, w, h, rows):
+        bot = self.module
+        self.timer = bot.TurnTimer()
+        self.timer.start(0)
+        self.outputs = list()
+        self.maze = bot.init_maze(w, h, rows)
+        if self.strategy_name is None:
+            self.con = bot.Controller(self.timer)
+        else:
+            self.con = bot.Controller(self.timer, self.strategy_name)
+        self.c = bot.Commander(self.outputs.append)
+        self.my_pacs = dict()
+
+    def turn(self, turn_id, turn):
+        if turn_id > 0:
+            self.timer.start(turn_id)
+        self.my_pacs, _ = self.module.take_turn(turn_id, turn, self.my_pacs, self.maze, self.con, self.c)
+        self.timer.stop()
+        return self.outputs.pop()
+
+    def stop(self):
+        pass
+
+
+class ProcessBot:
+    """ Bot script run in a child process and fed the referee protocol on stdin, one output line per turn
+
+    Plays any CodinGame style script, e.g. the baseline bot, whatever functions it does or does not expose
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.process = None
+
+    def _send(self, lines):
+        self.process.stdin.write('\n'.join(lines) + '\n')
+        self.process.stdin.flush()
+
+    def start(self, w, h, rows):
+        self.process = subprocess.Popen([sys.executable, self.path], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self._send([f'{w} {h}'] + list(rows))
+
+    def turn(self, turn_id, turn):
+        lines = [f'{turn.my_score} {turn.opponent_score}', str(len(turn.pacs))]
+        lines.extend(f'{pac_id} {int(mine)} {x} {y} {type_id} {speed_turns_left} {ability_cooldown}'
+                     for pac_id, mine, x, y, type_id, speed_turns_left, ability_cooldown in turn.pacs)
+        lines.append(str(len(turn.pellets)))
+        lines.extend(f'{x} {y} {value}' for x, y, value in turn.pellets)
+        self._send(lines)
+        output = self.process.stdout.readline()
+        if not output:
+            try:
+                code = self.process.wait(1)
+            except subprocess.TimeoutExpired:
+                code = None
+            raise RuntimeError(f'{self.path} closed its output, exit code {code}')
+        return output.strip()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+
+class Game:
+    def __init__(self, rows, pac_count, seed=None):
+        self.rnd = random.Random(seed)
+        self.rows = rows
+        self.w, self.h = len(rows[0]), len(rows)
+        self.maze = player.Maze(self.w, self.h, rows)
+        self.maze.construct_distances()
+        self.maze.construct_visibility()
+        self.scores = [0, 0]
+        self.turn_id = 0
+
+        # Mirrored start positions and types, player 0 on the left half
+        floor = [self.maze.cells[i] for i in self.maze.floor_cells]
+        left = [(x, y) for x, y in floor if x < self.w // 2]
+        self.pacs = list()
+        for pac_id, (x, y) in enumerate(self.rnd.sample(left, pac_count)):
+            type_id = self.rnd.choice(PAC_TYPES)
+            self.pacs.append(SimPac(0, pac_id, (x, y), type_id))
+            self.pacs.append(SimPac(1, pac_id, (self.w - 1 - x, y), type_id))
+
+        occupied = {pac.cell for pac in self.pacs}
+        self.pellets = {cell: 1 for cell in floor if cell not in occupied}
+        for x, y in self.rnd.sample([cell for cell in self.pellets if cell[0] < self.w // 2], SUPER_PELLET_PAIRS):
+            self.pellets[(x, y)] = player.SUPER_PELLET_VALUE
+            self.pellets[(self.w - 1 - x, y)] = player.SUPER_PELLET_VALUE
+
+    def turn_input(self, owner):
+        """ TurnInput as seen by `owner` through the fog of war """
+        visible_mask = self.maze.get_visible_mask([pac.cell for pac in self.pacs if pac.alive and pac.owner == owner])
+
+        # Dead pacs of both players are still sent, on their last cell with type DEAD
+        pacs = list()
+        for pac in self.pacs:
+            x, y = pac.cell
+            if not pac.alive:
+                pacs.append((pac.id, pac.owner == owner, x, y, 'DEAD', 0, 0))
+            elif pac.owner == owner or visible_mask >> (y * self.w + x) & 1:
+                pacs.append((pac.id, pac.owner == owner, x, y, pac.type_id, pac.speed_turns_left,
+                             pac.ability_cooldown))
+
+        pellets = [(x, y, value) for (x, y), value in self.pellets.items()
+                   if value > 1 or visible_mask >> (y * self.w + x) & 1]
+
+        return player.TurnInput(self.scores[owner], self.scores[1 - owner], pacs, pellets)
+
+    @staticmethod
+    def parse_commands(output):
+        """ pac_id -> ('MOVE', (x, y)) / ('SPEED', None) / ('SWITCH', type) from Commander formatted output """
+        actions = dict()
+        for command in output.split('|'):
+            words = command.split()
+            try:
+                if words[0] == 'MOVE':
+                    actions[int(words[1])] = ('MOVE', (int(words[2]), int(words[3])))
+                elif words[0] == 'SPEED':
+                    actions[int(words[1])] = ('SPEED', None)
+                elif words[0] == 'SWITCH' and words[2] in PAC_TYPES:
+                    actions[int(words[1])] = ('SWITCH', words[2])
+            except (IndexError, ValueError):
+                continue
+        return actions
+
+    @staticmethod
+    def blocks(a, b):
+        return a.owner == b.owner or a.type_id == b.type_id
+
+    def _step(self, movers):
+        """ Moves every pac in `movers` (pac -> target cell) by one cell, resolving blocks, combat and pellets """
+        alive = [pac for pac in self.pacs if pac.alive]
+        start = {pac: pac.cell for pac in alive}
+        intended = {pac: pac.cell for pac in alive}
+        for pac, target in movers.items():
+            intended[pac] = self.maze.next_cell(pac.cell, target)
+
+        # Cancel blocked moves until no two blocking pacs would share or swap a cell
+        changed = True
+        while changed:
+            changed = False
+            for i, a in enumerate(alive):
+                for b in alive[i + 1:]:
+                    if not self.blocks(a, b):
+                        continue
+                    if intended[a] == intended[b] or (intended[a] == start[b] and intended[b] == start[a]):
+                        for pac in (a, b):
+                            if intended[pac] != start[pac]:
+                                intended[pac] = start[pac]
+                                changed = True
+
+        for pac in alive:
+            pac.cell = intended[pac]
+
+        # Combat between enemies sharing or crossing a cell
+        for i, a in enumerate(alive):
+            for b in alive[i + 1:]:
+                if a.owner == b.owner:
+                    continue
+                if a.cell == b.cell or (a.cell == start[b] and b.cell == start[a]):
+                    if BEATS[a.type_id] == b.type_id:
+                        b.alive = False
+                    elif BEATS[b.type_id] == a.type_id:
+                        a.alive = False
+
+        # Surviving pacs eat pellets, both players score when they land on the same one
+        eaten = dict()
+        for pac in alive:
+            if pac.alive and self.pellets.get(pac.cell):
+                eaten.setdefault(pac.cell, set()).add(pac.owner)
+        for cell, owners in eaten.items():
+            for owner in owners:
+                self.scores[owner] += self.pellets[cell]
+            del self.pellets[cell]
+
+    def play_turn(self, actions):
+        """ Applies both players' actions, `actions` is [pac_id -> action] per player """
+        movers = dict()
+        activated = set()
+        for pac in self.pacs:
+            if not pac.alive:
+                continue
+            action, arg = actions[pac.owner].get(pac.id, (None, None))
+            if action == 'MOVE':
+                if 0 <= arg[0] < self.w and 0 <= arg[1] < self.h and self.maze.is_floor(*arg) and arg != pac.cell:
+                    movers[pac] = arg
+            elif action in ('SPEED', 'SWITCH') and pac.ability_cooldown == 0:
+                if action == 'SPEED':
+                    pac.speed_turns_left = SPEED_DURATION
+                else:
+                    pac.type_id = arg
+                pac.ability_cooldown = ABILITY_COOLDOWN
+                activated.add(pac)
+
+        self._step(movers)
+        fast_movers = {pac: target for pac, target in movers.items()
+                       if pac.alive and pac.speed_turns_left > 0 and pac.cell != target}
+        if fast_movers:
+            self._step(fast_movers)
+
+        for pac in self.pacs:
+            if pac not in activated:
+                pac.speed_turns_left = max(0, pac.speed_turns_left - 1)
+                pac.ability_cooldown = max(0, pac.ability_cooldown - 1)
+        self.turn_id += 1
+
+    def is_over(self):
+        remaining = sum(self.pellets.values())
+        for owner in (0, 1):
+            if not any(pac.alive and pac.owner == owner for pac in self.pacs):
+                # A player without pacs forfeits the remaining pellets to the opponent
+                self.scores[1 - owner] += remaining
+                self.pellets.clear()
+                return True
+        if self.turn_id >= MAX_TURNS or remaining == 0:
+            return True
+        return any(self.scores[owner] + remaining < self.scores[1 - owner] for owner in (0, 1))
+
+
+def play_game(bots, seed, width=None, height=None, pac_count=None):
+    """ Plays one game between the two bots, map size and pac count are drawn from `seed` when not given """
+    rnd = random.Random(seed)
+    width = width or rnd.randint(28, 35)
+    height = height or rnd.randint(10, 17)
+    pac_count = pac_count or rnd.randint(2, 5)
+    rows = generate_map(width, height, seed)
+    game = Game(rows, pac_count, seed)
+
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')  # The bots log every turn
+    crashed = None
+    error = None
+    turn_times = ([], [])
+    try:
+        for owner, bot in enumerate(bots):
+            try:
+                bot.start(width, height, rows)
+            except Exception as e:
+                crashed, error = owner, f'{type(e).__name__}: {e}'
+                break
+
+        while crashed is None and not game.is_over():
+            actions = list()
+            for owner, bot in enumerate(bots):
+                t0 = time.perf_counter()
+                try:
+                    output = bot.turn(game.turn_id, game.turn_input(owner))
+                except Exception as e:
+                    crashed, error = owner, f'{type(e).__name__}: {e}'
+                    break
+                turn_times[owner].append(time.perf_counter() - t0)
+                actions.append(game.parse_commands(output))
+            if crashed is None:
+                game.play_turn(actions)
+    finally:
+        for bot in bots:
+            bot.stop()
+        sys.stderr.close()
+        sys.stderr = stderr
+
+    if crashed is not None:
+        winner = 1 - crashed
+    elif game.scores[0] == game.scores[1]:
+        winner = -1
+    else:
+        winner = 0 if game.scores[0] > game.scores[1] else 1
+
+    return GameResult(seed, width, height, pac_count, tuple(game.scores), winner, game.turn_id, crashed, error,
+                      turn_times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    for seed in range(args.seed, args.seed + args.games):
+        result = play_game([PlayerBot(), PlayerBot()], seed)
+        crashed = f' | player {result.crashed} crashed: {result.error}' if result.crashed is not None else ''
+        print(f'seed {seed:4d} | {result.width}x{result.height} {result.pac_count} pacs | '
+              f'{result.turns:3d} turns | score {result.scores[0]:3d} - {result.scores[1]:3d}{crashed}')
+    elapsed = time.perf_counter() - t0
+    print(f'{args.games} games in {elapsed:.1f}s, {3600 * args.games / elapsed:.0f} games per hour on one core')
@@ -0,0 +1,213 @@
+""" Parallel self-play tournament between player.py variants
+
+A variant is `[path.py][@revision][:strategy]`, e.g. `greedy`, `player.py:greedy`, `old/player.py` or
+`player.py@HEAD~5`. The path defaults to player.py, the revision to the working tree and the strategy to that
+bot's default Controller strategy. A git revision plays the file as committed at that revision. Bots whose
+`init_maze`, `take_turn`, `Controller` and `Commander` take the arguments simulator.PlayerBot passes play in
+process, any other script, like the baseline bot or older revisions, runs in a child process fed the referee
+protocol. Every pair of variants plays each seeded map twice with sides swapped, games run on all cores and
+results are appended to a compact binary file as they finish.
+
+Usage:
+    python tournament.py lookahead greedy old/player.py --games 200 --out results.bin
+    python tournament.py player.py player.py@HEAD~10 --games 50
+    python tournament.py --summary results.bin
+"""
+import argparse
+import importlib.util
+import inspect
+import itertools
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import simulator
+
+
+MAGIC = b'SC20'
+RECORD = struct.Struct('<IBBBBBHHHbbffffff')
+# seed, variant of player 0, variant of player 1, width, height, pac count, score 0, score 1, turns, winner,
+# crashed player (-1 for none), then per player mean / p99 / max turn time in milliseconds
+
+_variants = dict()  # Variants loaded in this worker process, spec -> (path, module or None, strategy name)
+
+
+def parse_variant(spec):
+    """ `[path.py][@revision][:strategy]` -> (path, git revision or None, strategy name or None) """
+    path, strategy_name = spec.rsplit(':', 1) if ':' in spec else (spec, '')
+    path, revision = path.split('@', 1) if '@' in path else (path, '')
+    if not path.endswith('.py') and not revision:
+        path, strategy_name = '', path or strategy_name  # Bare strategy name
+    return (path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'player.py'), revision or None,
+            strategy_name or None)
+
+
+def checkout(path, revision):
+    """ Path of a temporary copy of `path` as committed at git `revision`, shared by every worker """
+    directory = os.path.dirname(os.path.abspath(path))
+    git = ['git', '-C', directory]
+    commit = subprocess.run(git + ['rev-parse', '--verify', f'{revision}^{{commit}}'], capture_output=True,
+                            text=True, check=True).stdout.strip()
+    name = subprocess.run(git + ['ls-files', '--full-name', '--error-unmatch', os.path.abspath(path)],
+                          capture_output=True, text=True, check=True).stdout.strip()
+    copy = os.path.join(tempfile.gettempdir(), f'variant_{commit[:12]}_{os.path.basename(path)}')
+    if not os.path.exists(copy):
+        source = subprocess.run(git + ['show', f'{commit}:{name}'], capture_output=True, check=True).stdout
+        partial = f'{copy}.{os.getpid()}'
+        with open(partial, 'wb') as f:
+            f.write(source)
+        os.replace(partial, copy)  # Atomic, concurrent workers write the same content
+    return copy
+
+
+def plays_in_process(module, strategy_name):
+    """ True when `module` takes the calls simulator.PlayerBot makes, checked on the signatures only """
+    calls = [(module.init_maze, 3), (module.take_turn, 6), (module.Commander, 1),
+             (module.Controller, 1 if strategy_name is None else 2)]
+    try:
+        module.TurnTimer
+        for function, argument_count in calls:
+            inspect.signature(function).bind(*[None] * argument_count)
+    except (AttributeError, TypeError, ValueError):
+        return False
+    return True
+
+
+def load_variant(spec):
+    if spec not in _variants:
+        path, revision, strategy_name = parse_variant(spec)
+        if revision is not None:
+            path = checkout(path, revision)
+        with open(path) as f:
+            module = None
+            if '\ndef take_turn(' in f.read():  # A plain stdin / stdout script would start reading input on import
+                module_spec = importlib.util.spec_from_file_location(f'variant_{len(_variants)}', path)
+                module = importlib.util.module_from_spec(module_spec)
+                module_spec.loader.exec_module(module)
+                if not plays_in_process(module, strategy_name):
+                    module = None
+        if module is None:
+            if strategy_name is not None:
+                raise ValueError(f'{spec}: strategies need a bot playing in process')
+            _variants[spec] = (path, None, None)
+        else:
+            if strategy_name is not None and strategy_name not in module.Controller.strategies:
+                raise ValueError(f'{path} has no strategy {strategy_name}')
+            _variants[spec] = (path, module, strategy_name)
+    path, module, strategy_name = _variants[spec]
+    if module is None:
+        return simulator.ProcessBot(path)
+    return simulator.PlayerBot(module, strategy_name)
+
+
+def turn_stats(times):
+    if not times:
+        return 0.0, 0.0, 0.0
+    ordered = sorted(times)
+    return (1000 * sum(ordered) / len(ordered), 1000 * ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))],
+            1000 * ordered[-1])
+
+
+def run_match(task):
+    """ Worker entry point: plays one game and returns its packed record """
+    seed, variant_0, variant_1, specs = task
+    result = simulator.play_game([load_variant(specs[variant_0]), load_variant(specs[variant_1])], seed)
+    return RECORD.pack(seed, variant_0, variant_1, result.width, result.height, result.pac_count,
+                       result.scores[0], result.scores[1], result.turns, result.winner,
+                       -1 if result.crashed is None else result.crashed,
+                       *turn_stats(result.turn_times[0]), *turn_stats(result.turn_times[1]))
+
+
+def write_header(f, specs):
+    names = json.dumps(specs).encode()
+    f.write(MAGIC + struct.pack('<I', len(names)) + names)
+
+
+def read_results(path):
+    """ Returns (variant specs, [record tuples]) from a results file """
+    with open(path, 'rb') as f:
+        if f.read(4) != MAGIC:
+            raise ValueError(f'{path} is not a tournament results file')
+        size, = struct.unpack('<I', f.read(4))
+        specs = json.loads(f.read(size).decode())
+        data = f.read()
+    records = [RECORD.unpack_from(data, offset) for offset in range(0, len(data) - RECORD.size + 1, RECORD.size)]
+    return specs, records
+
+
+def summarise(specs, records):
+    stats = {i: dict(games=0, wins=0, draws=0, score=0, diff=0, crashes=0, mean=0.0, p99=0.0, max=0.0)
+             for i in range(len(specs))}
+    for record in records:
+        seed, v0, v1, w, h, pac_count, s0, s1, turns, winner, crashed = record[:11]
+        timings = (record[11:14], record[14:17])
+        for side, variant in enumerate((v0, v1)):
+            st = stats[variant]
+            st['games'] += 1
+            st['wins'] += winner == side
+            st['draws'] += winner == -1
+            st['score'] += (s0, s1)[side]
+            st['diff'] += (s0, s1)[side] - (s0, s1)[1 - side]
+            st['crashes'] += crashed == side
+            st['mean'] += timings[side][0]
+            st['p99'] = max(st['p99'], timings[side][1])
+            st['max'] = max(st['max'], timings[side][2])
+
+    print(f'{len(records)} games')
+    print(f'{"variant":<32} {"games":>6} {"win %":>6} {"draw %":>6} {"score":>6} {"diff":>6} {"crash":>5} '
+          f'{"turn ms":>8} {"p99 ms":>7} {"max ms":>7}')
+    for i, spec in enumerate(specs):
+        st = stats[i]
+        games = st['games'] or 1
+        print(f'{spec:<32} {st["games"]:6d} {100.0 * st["wins"] / games:6.1f} {100.0 * st["draws"] / games:6.1f} '
+              f'{st["score"] / games:6.1f} {st["diff"] / games:+6.1f} {st["crashes"]:5d} '
+              f'{st["mean"] / games:8.2f} {st["p99"]:7.2f} {st["max"]:7.2f}')
+
+
+def tasks(specs, games, seed):
+    # Every pair of variants, or a variant against itself, plays each seed once from each side
+    pairs = list(itertools.combinations(range(len(specs)), 2)) or [(0, 0)]
+    for game_seed in range(seed, seed + games):
+        for a, b in pairs:
+            yield game_seed, a, b, specs
+            if a != b:
+                yield game_seed, b, a, specs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('variants', nargs='*', default=['player.py'])
+    parser.add_argument('--games', type=int, default=100, help='seeded maps per pair of variants')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default='tournament.bin')
+    parser.add_argument('--summary', help='print the summary of an existing results file and exit')
+    args = parser.parse_args()
+
+    if args.summary:
+        summarise(*read_results(args.summary))
+        sys.exit()
+
+    specs = list(args.variants)
+    for spec in specs:
+        load_variant(spec)  # Fail early on a bad variant
+
+    t0 = time.perf_counter()
+    done = 0
+    with open(args.out, 'wb') as f, ProcessPoolExecutor(max_workers=args.workers) as pool:
+        write_header(f, specs)
+        for record in pool.map(run_match, tasks(specs, args.games, args.seed), chunksize=4):
+            f.write(record)
+            f.flush()
+            done += 1
+            if done % 50 == 0:
+                print(f'{done} games, {time.perf_counter() - t0:.0f}s', file=sys.stderr)
+
+    elapsed = time.perf_counter() - t0
+    print(f'{done} games in {elapsed:.1f}s on {args.workers} workers ({3600 * done / elapsed:.0f} games per hour)')
+    summarise(*read_results(args.out))